@@ -0,0 +1,114 @@
+"""Throughput del envío masivo contra una Bot API falsa local.
+
+Uso: python benchmarks/bench_broadcast.py [--subscribers 100000] [--concurrency 20]
+
+1. Envío completo sin límite de tasa: mide el coste propio del pipeline
+   (SQLite + lotes + PTB/httpx) y estima lo que tardaría a 30 msg/s.
+2. Envío interrumpido a mitad y reanudado: con parada ordenada (`stop()`)
+   no debe repetirse ningún mensaje (si no, sale con código 1); cancelando
+   la tarea solo pueden repetirse los que estaban en vuelo.
+3. Envío con el límite real (30 msg/s) y 429 periódicos: comprueba la tasa
+   observada y los reintentos.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from broadcast import SubscriberStore, Broadcaster
+from fake_bot_api import FakeBotAPI
+
+
+async def make_bot(api, pool_size):
+    bot = Bot("123:fake", base_url=api.base_url, request=HTTPXRequest(connection_pool_size=pool_size))
+    await bot.initialize()
+    return bot
+
+
+async def full_run(tmp, subscribers, concurrency):
+    api = await FakeBotAPI().start()
+    store = SubscriberStore(os.path.join(tmp, "full.db"))
+    store.add_many(range(1, subscribers + 1))
+    bot = await make_bot(api, concurrency)
+    t0 = time.perf_counter()
+    state = await Broadcaster(bot, store, rate=0, concurrency=concurrency).run("full", "Mensaje lunar")
+    elapsed = time.perf_counter() - t0
+    print(f"Envío completo: {state['sent']:,} mensajes en {elapsed:.1f} s → {state['sent'] / elapsed:,.0f} msg/s "
+          f"(a 30 msg/s serían {subscribers / 30 / 3600:.1f} h)")
+    await bot.shutdown()
+    await api.stop()
+    store.close()
+
+
+async def resume_run(tmp, subscribers, concurrency, graceful):
+    """Devuelve el número de mensajes repetidos."""
+    name = "stop" if graceful else "cancel"
+    api = await FakeBotAPI().start()
+    store = SubscriberStore(os.path.join(tmp, f"resume-{name}.db"))
+    store.add_many(range(1, subscribers + 1))
+    bot = await make_bot(api, concurrency)
+    broadcaster = Broadcaster(bot, store, rate=0, concurrency=concurrency)
+    task = asyncio.create_task(broadcaster.run(name, "Mensaje lunar"))
+    while sum(api.sent.values()) < subscribers // 2:
+        await asyncio.sleep(0.01)
+    if graceful:
+        broadcaster.stop()
+    else:
+        task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    interrupted_at = sum(api.sent.values())
+    state = await Broadcaster(bot, store, rate=0, concurrency=concurrency).resume(name)
+    duplicates = sum(n - 1 for n in api.sent.values() if n > 1)
+    missing = subscribers - len(api.sent)
+    expected = "0" if graceful else f"≤ {concurrency} en vuelo"
+    print(f"Reanudación tras {'stop()' if graceful else 'cancelar'}: cortado tras {interrupted_at:,}, "
+          f"total {state['sent']:,}, repetidos {duplicates} ({expected}), sin enviar {missing}")
+    await bot.shutdown()
+    await api.stop()
+    store.close()
+    return duplicates
+
+
+async def limited_run(tmp, subscribers):
+    api = await FakeBotAPI(retry_after_every=50, retry_after=1).start()
+    store = SubscriberStore(os.path.join(tmp, "limited.db"))
+    store.add_many(range(1, subscribers + 1))
+    bot = await make_bot(api, 20)
+    t0 = time.perf_counter()
+    state = await Broadcaster(bot, store, rate=30).run("limited", "Mensaje lunar")
+    elapsed = time.perf_counter() - t0
+    # Ventana de 1 s con más envíos: no debería superar la capacidad del bucket + 30.
+    times = api.sent_at
+    peak = max(sum(1 for t in times[i:i + 100] if t - times[i] < 1) for i in range(len(times)))
+    print(f"Con límite 30 msg/s: {state['sent']} enviados en {elapsed:.1f} s "
+          f"({state['sent'] / elapsed:.1f} msg/s, pico {peak} en 1 s, {api.requests - state['sent'] - 1} respuestas 429)")
+    await bot.shutdown()
+    await api.stop()
+    store.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=100000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--limited", type=int, default=300, help="suscriptores en la prueba con límite real")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        await full_run(tmp, args.subscribers, args.concurrency)
+        duplicates = await resume_run(tmp, args.subscribers // 10, args.concurrency, graceful=True)
+        await resume_run(tmp, args.subscribers // 10, args.concurrency, graceful=False)
+        await limited_run(tmp, args.limited)
+    if duplicates:
+        print(f"ERROR: {duplicates} mensajes repetidos tras una parada ordenada")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""Latencia de las consultas de contenido mientras se recarga un contenido 100x mayor.
+
+Uso: python benchmarks/bench_content.py [--scale 100]
+
+Genera en un directorio temporal una copia de los tres JSON con cada tema
+replicado `--scale` veces, y simula peticiones (una consulta al índice cada
+milisegundo) antes y durante varias recargas en caliente. Muestra la latencia
+de cada petición (incluida la espera en el event loop) y cuánto tarda cada
+recarga.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from content import ContentManager, CONTENT_FILES, save_snapshot
+
+PHASES = ["Luna Nueva", "Cuarto Creciente", "Luna Llena", "Cuarto Menguante"]
+
+
+def write_scaled(tmp, scale):
+    paths = []
+    for path in CONTENT_FILES:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if path.startswith("rituals"):
+            data = {
+                phase: {
+                    kind: {f"{theme}{i or ''}": items * 10 for theme, items in themes.items() for i in range(scale)}
+                    for kind, themes in kinds.items()
+                }
+                for phase, kinds in data.items()
+            }
+        elif path.startswith("moon_data"):
+            data = {phase: {k: v * scale for k, v in sections.items()} for phase, sections in data.items()}
+        target = os.path.join(tmp, path)
+        with open(target, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        paths.append(target)
+    return paths
+
+
+def summary(label, latencies):
+    latencies = sorted(latencies)
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(f"{label:16} {len(latencies):6} peticiones  p50 {p(0.5):6.3f} ms  p99 {p(0.99):6.3f} ms  máx {latencies[-1] * 1000:6.3f} ms")
+
+
+async def requests(manager, stop):
+    latencies = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.001)
+        index = manager.index
+        index.choice("Luna Llena", "mantras", "Amor")
+        index.available("Luna Llena", "conjuros")
+        latencies.append(time.perf_counter() - t0 - 0.001)
+    return latencies
+
+
+async def run(scale, reloads):
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_scaled(tmp, scale)
+        size = sum(os.path.getsize(p) for p in paths)
+        t0 = time.perf_counter()
+        manager = ContentManager(paths, PHASES)
+        print(f"Contenido x{scale}: {size / 1e6:.1f} MB, compilación inicial {time.perf_counter() - t0:.2f} s")
+        snapshot = os.path.join(tmp, "content.snapshot")
+        save_snapshot(snapshot, paths, PHASES)
+        t0 = time.perf_counter()
+        ContentManager(paths, PHASES, snapshot_path=snapshot)
+        print(f"  desde snapshot ({os.path.getsize(snapshot) / 1e6:.1f} MB): {time.perf_counter() - t0:.2f} s")
+
+        stop = asyncio.Event()
+        asyncio.get_running_loop().call_later(2, stop.set)
+        summary("sin recarga", await requests(manager, stop))
+
+        async def reload_loop(stop):
+            for _ in range(reloads):
+                t0 = time.perf_counter()
+                await manager.reload()
+                print(f"  recarga a versión {manager.index.version} en {time.perf_counter() - t0:.2f} s")
+            stop.set()
+
+        stop = asyncio.Event()
+        latencies, _ = await asyncio.gather(requests(manager, stop), reload_loop(stop))
+        summary("durante recarga", latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=100)
+    parser.add_argument("--reloads", type=int, default=3)
+    args = parser.parse_args()
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    asyncio.run(run(args.scale, args.reloads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Precisión y coste de la tabla de efemérides frente a astral.
+
+Uso: python benchmarks/bench_ephemeris.py
+
+1. Comprueba que la elongación de la tabla coincide con la de
+   `astral.moon.phase` (a 00:00 UTC de cada día cubierto) con una tolerancia
+   de 1.5°, y la distancia con el ejemplo 47.a de Meeus (368 409.7 km ± 1 km).
+2. Mide lo que costaba un /luna con las funciones anteriores (dos llamadas a
+   astral más la distancia sinusoidal) frente a una consulta de la tabla.
+"""
+import os
+import sys
+import math
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from astral.moon import phase
+from ephemeris import Ephemeris, compute_moon, load_or_build
+
+ELONGATION_TOLERANCE_DEG = 1.5
+DISTANCE_TOLERANCE_KM = 1.0
+ITERATIONS = 100000
+
+
+def astral_elongation(day):
+    # astral trunca la elongación a grados enteros y le suma 6.43° antes de escalar a 28 días.
+    return (phase(day) / 28 * 360 - 6.43) % 360
+
+
+def check_accuracy(table):
+    start = datetime.fromtimestamp(table.start_hour * 3600, timezone.utc)
+    day = (start + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    worst = 0.0
+    days = 0
+    while table.covers(day):
+        ours = table.snapshot(day).phase_fraction * 360
+        diff = abs((ours - astral_elongation(day.date()) + 180) % 360 - 180)
+        worst = max(worst, diff)
+        days += 1
+        day += timedelta(days=1)
+    print(f"Elongación vs astral: {days} días, desviación máxima {worst:.2f}°")
+    assert worst <= ELONGATION_TOLERANCE_DEG, f"Desviación {worst:.2f}° > {ELONGATION_TOLERANCE_DEG}°"
+
+    distance = compute_moon(2448724.5)[2]
+    print(f"Distancia 1992-04-12 0h TD: {distance:.1f} km (Meeus: 368409.7 km)")
+    assert abs(distance - 368409.7) <= DISTANCE_TOLERANCE_KM
+
+
+def legacy_luna():
+    phase_value = phase(datetime.now())
+    phase_value = phase(datetime.now())
+    illumination = round(abs(math.sin(phase_value * math.pi)) * 100, 1)
+    day_of_year = datetime.now().timetuple().tm_yday
+    distance = round(384400 + 25000 * math.sin(2 * math.pi * day_of_year / 365.25), -3)
+    return phase_value, illumination, distance
+
+
+def timeit(func):
+    t0 = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func()
+    return (time.perf_counter() - t0) / ITERATIONS * 1e6
+
+
+def main():
+    t0 = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    built = Ephemeris.build(now - timedelta(days=1826), now + timedelta(days=1826))
+    print(f"Construcción ±5 años: {built.count} horas, {built.nbytes / 1e6:.2f} MB en {time.perf_counter() - t0:.2f} s")
+
+    table = load_or_build()
+    check_accuracy(table)
+
+    print(f"astral (anterior)   {timeit(legacy_luna):7.2f} µs/llamada")
+    print(f"tabla (snapshot)    {timeit(table.snapshot):7.2f} µs/llamada")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Benchmark de los handlers de main.py con Update/Context falsos.
+
+Uso:
+    python benchmarks/bench_handlers.py --save benchmarks/baseline.json
+    python benchmarks/bench_handlers.py --compare benchmarks/baseline.json [--threshold 0.25]
+
+Para cada escenario mide la latencia por llamada (media, p50, p99), la
+memoria reservada por llamada con tracemalloc (pico sobre lo ya reservado)
+y el rendimiento con N usuarios simultáneos; latencia y rendimiento se
+miden en varias rondas y se guarda la mejor. Con --compare sale con código 1
+si algún handler empeora más de `--threshold` (fracción) respecto a la línea
+base en p50, memoria o rendimiento concurrente.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import asyncio
+import argparse
+import platform
+import statistics
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import main
+from notes_store import SQLiteNoteStore
+from moon_cache import BoundaryCache
+from moon_times import MoonTimes, load_cities
+from fakes import StubBot, make_call
+
+# Los logger.info de los handlers escribirían miles de líneas en stderr.
+logging.disable(logging.INFO)
+
+# (nombre, handler, texto del mensaje)
+SCENARIOS = [
+    ("moon", main.moon, "/luna"),
+    ("moon_ciudad", main.moon, "/luna"),
+    ("moon_coordenadas", main.moon, "/luna"),
+    ("save_note", main.save_note, "Hoy terminé el primer capítulo de mi proyecto"),
+    ("show_logros", main.show_logros, "/logros"),
+    ("buscar", main.buscar, "/buscar nota 99"),
+    ("patrones", main.patrones, "/patrones"),
+    ("exportar", main.exportar, "/exportar csv"),
+    ("get_mantra", main.get_mantra, "/mantra proyectos"),
+    ("get_mantra_sin_tema", main.get_mantra, "/mantra"),
+    ("get_mantra_tema_desconocido", main.get_mantra, "/mantra viajes"),
+    ("get_meditacion", main.get_meditacion, "/meditacion proyectos"),
+    ("get_conjuro", main.get_conjuro, "/conjuro abundancia"),
+]
+# user_data de los escenarios que lo necesitan (ubicación guardada con /ubicacion).
+USER_DATA = {
+    "moon_ciudad": {"location": {"city": "madrid"}},
+    "moon_coordenadas": {"location": {"lat": 41.65, "lon": -0.88, "tz": "Europe/Madrid"}},
+}
+# Métrica -> True si un valor mayor es peor.
+COMPARED = {"p50_us": True, "alloc_kib": True, "concurrent_ups": False}
+USER_ID = 1
+SEEDED_NOTES = 1000
+
+
+def make_bot_data(tmp):
+    notes = SQLiteNoteStore(os.path.join(tmp, "notes.db"))
+    notes.append_many(
+        (str(USER_ID), {"date": "2026-10-18", "phase": "Luna Llena", "note": f"Nota {i}"}) for i in range(SEEDED_NOTES)
+    )
+    moon_cache = BoundaryCache(main.moon_message_key, main.render_moon_message, main.moon_message_boundary)
+    cities, _ = load_cities()
+    # Solo Madrid en la tabla: las coordenadas van a la caché LRU como en producción.
+    moon_times = MoonTimes({"madrid": cities["madrid"]}, days=2)
+    moon_times.build()
+    return {"notes": notes, "moon_cache": moon_cache, "moon_times": moon_times}
+
+
+async def latency(handler, text, bot, bot_data, iterations, user_data=None):
+    samples = []
+    for _ in range(iterations):
+        update, context = make_call(bot, bot_data, USER_ID, text, user_data=user_data)
+        t0 = time.perf_counter()
+        await handler(update, context)
+        samples.append(time.perf_counter() - t0)
+    bot.replies.clear()
+    samples.sort()
+    return {
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "p50_us": samples[len(samples) // 2] * 1e6,
+        "p99_us": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6,
+    }
+
+
+async def allocations(handler, text, bot, bot_data, iterations, user_data=None):
+    peaks = []
+    tracemalloc.start()
+    for _ in range(iterations):
+        update, context = make_call(bot, bot_data, USER_ID, text, user_data=user_data)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await handler(update, context)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    bot.replies.clear()
+    return {"alloc_kib": statistics.median(peaks) / 1024}
+
+
+async def concurrent(handler, text, bot, bot_data, users, user_data=None):
+    calls = [make_call(bot, bot_data, USER_ID + i, text, user_data=user_data) for i in range(users)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(handler(update, context) for update, context in calls))
+    elapsed = time.perf_counter() - t0
+    assert len(bot.replies) == users, f"{len(bot.replies)} respuestas para {users} usuarios"
+    bot.replies.clear()
+    return {"concurrent_ups": users / elapsed}
+
+
+async def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        bot_data = make_bot_data(tmp)
+        bot = StubBot()
+        for name, handler, text in SCENARIOS:
+            if args.only and name not in args.only:
+                continue
+            user_data = USER_DATA.get(name)
+            # Calentamiento: primera renderización, conexiones SQLite, etc.
+            await latency(handler, text, bot, bot_data, 10, user_data)
+            # Se repite cada medida y se queda la mejor ronda, para filtrar el ruido de la máquina.
+            rounds = [await latency(handler, text, bot, bot_data, args.iterations, user_data) for _ in range(args.repeat)]
+            result = min(rounds, key=lambda r: r["p50_us"])
+            result.update(await allocations(handler, text, bot, bot_data, max(50, args.iterations // 10), user_data))
+            rounds = [await concurrent(handler, text, bot, bot_data, args.users, user_data) for _ in range(args.repeat)]
+            result.update(max(rounds, key=lambda r: r["concurrent_ups"]))
+            results[name] = result
+            print(f"{name:30} p50 {result['p50_us']:8.1f} µs  p99 {result['p99_us']:8.1f} µs  "
+                  f"mem {result['alloc_kib']:7.1f} KiB  {args.users} usuarios {result['concurrent_ups']:9.0f} upd/s")
+        bot_data["notes"].close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        base = baseline["handlers"].get(name)
+        if base is None:
+            continue
+        for metric, higher_is_worse in COMPARED.items():
+            change = (result[metric] - base[metric]) / base[metric] if base[metric] else 0.0
+            if (change if higher_is_worse else -change) > threshold:
+                regressions.append(f"{name}.{metric}: {base[metric]:.1f} → {result[metric]:.1f} ({change:+.0%})")
+    return regressions
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200, help="usuarios simultáneos")
+    parser.add_argument("--repeat", type=int, default=5, help="rondas por medida (se toma la mejor)")
+    parser.add_argument("--only", type=lambda s: s.split(","), help="escenarios separados por comas")
+    parser.add_argument("--save", metavar="FICHERO", help="guarda los resultados como línea base")
+    parser.add_argument("--compare", metavar="FICHERO", help="compara con una línea base guardada")
+    parser.add_argument("--threshold", type=float, default=0.25, help="empeoramiento tolerado (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.save:
+        meta = {"date": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                "machine": platform.machine(), "iterations": args.iterations, "users": args.users, "repeat": args.repeat}
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "handlers": results}, f, indent=2)
+        print(f"Línea base guardada en {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regresiones por encima del {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"Sin regresiones por encima del {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    cli()
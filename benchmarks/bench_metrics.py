@@ -0,0 +1,94 @@
+"""Coste de la instrumentación por update.
+
+Uso: python benchmarks/bench_metrics.py [--iterations 200000]
+
+Compara un handler vacío llamado directamente con el mismo handler envuelto
+por Metrics.wrap (con y sin log JSON de tiempos), mide un Timer suelto y
+cuánto tarda en generarse la salida de /metrics con las series de main.py.
+"""
+import os
+import io
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Metrics, JsonFormatter
+from fakes import StubBot, make_call
+
+HANDLERS = ["/start", "/intro", "/luna", "/ubicacion", "shared_location", "/mantra", "/meditacion", "/conjuro",
+            "/anotar", "/cancelar", "save_note", "/logros", "change_logros_page", "/buscar", "/patrones", "/exportar",
+            "/contacto", "/suscribir", "/desuscribir", "/estado"]
+IO_OPS = [("astronomy", "snapshot"), ("astronomy", "next_phase_change"), ("astronomy", "moon_times"),
+          ("content", "render_luna"), ("content", "lookup"), ("storage", "add_note"), ("storage", "recent_notes"),
+          ("storage", "search_notes"), ("storage", "note_stats"), ("storage", "export_notes"),
+          ("storage", "subscribers"), ("telegram", "sendMessage"), ("telegram", "getUpdates")]
+
+
+async def handler(update, context):
+    pass
+
+
+async def per_call(func, update, context, iterations):
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        await func(update, context)
+    return (time.perf_counter() - t0) / iterations * 1e6
+
+
+async def run(iterations, repeat):
+    update, context = make_call(StubBot(), {}, 1, "/luna")
+
+    metrics = Metrics()
+    timer = metrics.timer("astronomy", "snapshot")
+    wrapped = metrics.wrap("/luna", handler)
+
+    async def with_span(update, context):
+        with timer.time():
+            pass
+
+    # Log JSON de tiempos a un buffer en memoria: se mide el formateo, no la escritura a disco.
+    logged_metrics = Metrics(log_timings=True)
+    logged = logged_metrics.wrap("/luna", with_span)
+    log_handler = logging.StreamHandler(io.StringIO())
+    log_handler.setFormatter(JsonFormatter())
+    timings_logger = logging.getLogger("lunia.timings")
+    timings_logger.addHandler(log_handler)
+    timings_logger.setLevel(logging.INFO)
+    timings_logger.propagate = False
+
+    base = min([await per_call(handler, update, context, iterations) for _ in range(repeat)])
+    plain = min([await per_call(wrapped, update, context, iterations) for _ in range(repeat)])
+    span = min([await per_call(with_span, update, context, iterations) for _ in range(repeat)])
+    json_log = min([await per_call(logged, update, context, iterations // 10) for _ in range(repeat)])
+
+    print(f"handler vacío              {base:6.2f} µs/update")
+    print(f"envuelto (histograma)      {plain:6.2f} µs/update  (+{plain - base:.2f} µs)")
+    print(f"Timer suelto               {span - base:6.2f} µs/medida")
+    print(f"envuelto + log JSON        {json_log:6.2f} µs/update  (+{json_log - base:.2f} µs)")
+
+    for name in HANDLERS:
+        metrics.wrap(name, handler)
+    for kind, op in IO_OPS:
+        metrics.timer(kind, op)
+    metrics.error(ValueError())
+    metrics.gauge("lunia_update_queue_size", "Updates en cola", lambda: 0)
+    t0 = time.perf_counter()
+    body = metrics.render()
+    print(f"render /metrics            {(time.perf_counter() - t0) * 1000:6.2f} ms  "
+          f"({len(body.splitlines())} líneas, {len(body) / 1024:.1f} KiB)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5, help="rondas por medida (se toma la mejor)")
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
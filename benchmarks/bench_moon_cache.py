@@ -0,0 +1,32 @@
+"""Coste por llamada del mensaje de /luna con y sin caché.
+
+Uso: python benchmarks/bench_moon_cache.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import render_moon_message, moon_message_key, moon_message_boundary
+from moon_cache import BoundaryCache
+
+ITERATIONS = 100000
+
+
+def timeit(func):
+    t0 = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func()
+    return (time.perf_counter() - t0) / ITERATIONS * 1e6
+
+
+def main():
+    cache = BoundaryCache(moon_message_key, render_moon_message, moon_message_boundary)
+    cache.get()
+    print(f"sin caché  {timeit(lambda: render_moon_message(time.time())):7.2f} µs/llamada")
+    print(f"con caché  {timeit(cache.get):7.2f} µs/llamada  {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Salida y puesta de la luna para muchas usuarias con ubicación guardada.
+
+Uso: python benchmarks/bench_moon_times.py [--users 10000] [--cities 200] [--days 1]
+
+Genera `--cities` ciudades sintéticas y `--users` usuarias repartidas entre
+ellas: la mitad con la ciudad guardada y la otra mitad con coordenadas
+propias a unos kilómetros de su ciudad. Mide:
+- el cálculo completo con astral en cada consulta (sin caché, una muestra),
+- la construcción de la tabla por ciudad y las consultas que la usan,
+- las consultas por coordenadas con la caché LRU por celda de la rejilla,
+  en frío (primera pasada) y en caliente, con su tasa de aciertos.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moon_times import MoonTimes, City, rise_set, GRID_CACHE_SIZE
+
+ZONES = ["Europe/Madrid", "America/Argentina/Buenos_Aires", "America/Mexico_City", "America/Bogota",
+         "America/Santiago", "America/Lima", "Europe/London", "Asia/Tokyo"]
+UNCACHED_SAMPLES = 300
+# Dispersión de las coordenadas alrededor de su ciudad (grados, ~±20 km).
+SPREAD = 0.2
+
+
+def make_cities(count):
+    cities = {}
+    for i in range(count):
+        key = f"ciudad {i}"
+        cities[key] = City(key, key.title(), random.uniform(-50, 60), random.uniform(-120, 140), random.choice(ZONES))
+    return cities
+
+
+def make_users(cities, count):
+    """Lista de (ciudad, None) o (ciudad, (lat, lon)) por usuaria."""
+    users = []
+    for i, city in enumerate(random.choices(list(cities.values()), k=count)):
+        if i % 2:
+            users.append((city, (city.lat + random.uniform(-SPREAD, SPREAD), city.lon + random.uniform(-SPREAD, SPREAD))))
+        else:
+            users.append((city, None))
+    return users
+
+
+def query(moon_times, user, day):
+    city, point = user
+    if point is None:
+        return moon_times.for_city(city, day)
+    return moon_times.for_coordinates(point[0], point[1], city.tz, day)
+
+
+def per_query_us(func, users):
+    t0 = time.perf_counter()
+    for user in users:
+        func(user)
+    return (time.perf_counter() - t0) / len(users) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--cities", type=int, default=200)
+    parser.add_argument("--days", type=int, default=1, help="días de la tabla además de hoy")
+    args = parser.parse_args()
+    random.seed(1)
+    cities = make_cities(args.cities)
+    users = make_users(cities, args.users)
+    day = datetime.now(timezone.utc).date()
+
+    moon_times = MoonTimes(cities, days=args.days)
+    sample = random.sample(users, min(UNCACHED_SAMPLES, len(users)))
+    uncached = per_query_us(lambda user: rise_set(*(user[1] or (user[0].lat, user[0].lon)),
+                                                  moon_times.zone(user[0].tz), day), sample)
+    print(f"{args.users:,} usuarias en {args.cities} ciudades")
+    print(f"  sin caché (astral)        {uncached:10.1f} µs/consulta  "
+          f"({uncached * args.users / 1e6:.1f} s para todas)")
+
+    t0 = time.perf_counter()
+    computed = moon_times.build()
+    build_s = time.perf_counter() - t0
+    print(f"  tabla: {computed} entradas en {build_s:.2f} s ({build_s / computed * 1e3:.2f} ms por entrada)")
+
+    by_city = [user for user in users if user[1] is None]
+    by_point = [user for user in users if user[1] is not None]
+    table_us = per_query_us(lambda user: query(moon_times, user, day), by_city)
+    print(f"  ciudad, tabla             {table_us:10.2f} µs/consulta  ({moon_times.table_hits:,} aciertos)")
+
+    cold_us = per_query_us(lambda user: query(moon_times, user, day), by_point)
+    cold = moon_times.stats()
+    warm_us = per_query_us(lambda user: query(moon_times, user, day), by_point)
+    warm = moon_times.stats()
+    lookups = cold["hits"] + cold["misses"]
+    print(f"  coordenadas, LRU en frío  {cold_us:10.1f} µs/consulta  "
+          f"(aciertos {cold['hits'] / lookups:.0%}, {cold['misses']:,} celdas calculadas)")
+    print(f"  coordenadas, LRU caliente {warm_us:10.2f} µs/consulta  "
+          f"(aciertos {(warm['hits'] - cold['hits']) / len(by_point):.0%}, "
+          f"{warm['cached']:,} celdas en caché de {GRID_CACHE_SIZE:,})")
+    total = moon_times.table_hits + warm["hits"]
+    print(f"  total: {total / (len(by_city) + 2 * len(by_point)):.0%} de las consultas sin astral")
+
+
+if __name__ == "__main__":
+    main()
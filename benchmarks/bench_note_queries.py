@@ -0,0 +1,150 @@
+"""Búsqueda, patrones, paginación y exportación con usuarios de muchas notas.
+
+Uso: python benchmarks/bench_note_queries.py [--notes-per-user 10000,50000] [--users 5]
+
+Llena cada backend con `--users` usuarios de N notas (más ruido de otros
+usuarios) y mide para uno de ellos:
+- /buscar con una palabra frecuente, una rara y una que no aparece,
+- /patrones con los agregados frente a recorrer todas las notas,
+- una página de /logros al principio y muy al fondo del historial,
+- /exportar en CSV: tiempo y pico de memoria (tracemalloc) frente a
+  construir el documento entero en memoria.
+"""
+import io
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notes_store import SQLiteNoteStore, LogNoteStore, write_export
+
+PHASES = ["Luna Nueva", "Luna Creciente", "Cuarto Creciente", "Gibosa Creciente",
+          "Luna Llena", "Gibosa Menguante", "Cuarto Menguante", "Luna Menguante"]
+WORDS = ("proyecto capítulo meditación ritual amor trabajo familia viaje lectura escritura "
+         "ejercicio descanso gratitud intención cierre comienzo energía calma idea avance").split()
+RARE = "eclipse"
+NOISE_USERS = 2000
+SAMPLES = 50
+
+
+def make_entry(i):
+    words = random.choices(WORDS, k=8)
+    if i % 1000 == 0:
+        words.append(RARE)
+    date = f"{2020 + i // 4000 % 7}-{i // 330 % 12 + 1:02d}-{i % 28 + 1:02d}"
+    return {"date": date, "phase": PHASES[i % 8], "note": " ".join(words).capitalize()}
+
+
+def fill(store, users, per_user):
+    batch = []
+    for i in range(per_user):
+        for user in range(users):
+            batch.append((f"u{user}", make_entry(i)))
+        # Notas de otros usuarios intercaladas, como en una base real.
+        batch.append((f"n{random.randrange(NOISE_USERS)}", make_entry(i)))
+        if len(batch) >= 50000:
+            store.append_many(batch)
+            batch = []
+    store.append_many(batch)
+
+
+def timed(func, samples=SAMPLES):
+    t0 = time.perf_counter()
+    for _ in range(samples):
+        result = func()
+    return (time.perf_counter() - t0) / samples * 1000, result
+
+
+def full_scan_stats(store, user_id):
+    """Lo que costaría /patrones sin agregados: leer todas las notas del usuario."""
+    phases, months = Counter(), Counter()
+    for chunk in store.export(user_id):
+        for n in chunk:
+            phases[n["phase"]] += 1
+            months[n["date"][:7]] += 1
+    return {"phases": phases, "months": months}
+
+
+def deepest_cursor(store, user_id, limit=10):
+    if isinstance(store, LogNoteStore):
+        return limit + 1
+    # En SQLite la id es global: la de la nota número `limit` del usuario.
+    first = next(store.export(user_id, limit + 1))
+    return first[-1]["id"]
+
+
+def peak_kib(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def export_in_memory(store, user_id):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(("date", "phase", "note"))
+    notes = [n for chunk in store.export(user_id) for n in chunk]
+    writer.writerows((n["date"], n["phase"], n["note"]) for n in notes)
+    return text.getvalue().encode("utf-8")
+
+
+def row(label, ms, detail=""):
+    print(f"  {label:22} {ms:8.2f} ms  {detail}".rstrip())
+
+
+def bench(name, store, per_user, users):
+    t0 = time.perf_counter()
+    fill(store, users, per_user)
+    print(f"\n{name}: {users} usuarios x {per_user:,} notas (+ ruido), {store.count():,} notas en total; "
+          f"carga {time.perf_counter() - t0:.1f} s")
+    user = "u0"
+    for label, text in [("frecuente", WORDS[0]), ("rara", RARE), ("dos palabras", f"{WORDS[1]} {WORDS[2]}"),
+                        ("sin resultados", "inexistente")]:
+        ms, found = timed(lambda: store.search(user, text), SAMPLES // 5 if name == "log" else SAMPLES)
+        row(f"buscar {label}", ms, f"({len(found)} resultados)")
+    ms, _ = timed(lambda: store.stats(user))
+    scan_ms, _ = timed(lambda: full_scan_stats(store, user), 3)
+    row("patrones", ms, f"(recorriendo todas las notas: {scan_ms:.1f} ms)")
+    ms, _ = timed(lambda: store.page(user))
+    row("logros 1ª página", ms)
+    cursor = deepest_cursor(store, user)
+    ms, _ = timed(lambda: store.page(user, before=cursor))
+    row("logros última página", ms)
+    with tempfile.TemporaryFile() as f:
+        def stream():
+            f.seek(0)
+            f.truncate()
+            return write_export(store.export(user), "csv", f)
+        ms, count = timed(stream, 3)
+        size = f.tell()
+        streamed = peak_kib(stream)
+    whole = peak_kib(lambda: export_in_memory(store, user))
+    row("exportar csv", ms, f"({count:,} notas, {size / 1024:.0f} KiB)  pico de memoria {streamed:.0f} KiB "
+                            f"(todo en memoria: {whole:.0f} KiB)")
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes-per-user", default="10000,50000")
+    parser.add_argument("--users", type=int, default=5, help="usuarios con muchas notas")
+    args = parser.parse_args()
+    random.seed(1)
+    for per_user in [int(n) for n in args.notes_per_user.split(",")]:
+        with tempfile.TemporaryDirectory() as tmp:
+            bench("sqlite", SQLiteNoteStore(os.path.join(tmp, "notes.db")), per_user, args.users)
+            bench("log", LogNoteStore(os.path.join(tmp, "notes.log")), per_user, args.users)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Latencia de guardar/leer notas según el volumen total almacenado.
+
+Uso: python benchmarks/bench_notes.py [--sizes 1000,10000,100000,1000000] [--users 5000]
+
+Para cada backend se va llenando el almacén hasta cada tamaño y se mide la
+latencia media de `append` (una nota) y de `recent` (últimas 10 notas de un
+usuario). Con --legacy se mide también el antiguo user_notes.json reescrito
+entero (solo hasta 10k notas: más allá es demasiado lento).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notes_store import SQLiteNoteStore, LogNoteStore
+
+PHASES = ["Luna Nueva", "Cuarto Creciente", "Luna Llena", "Cuarto Menguante"]
+SAMPLES = 500
+
+
+def make_entry(i):
+    return {"date": "2026-10-18", "phase": PHASES[i % 4], "note": f"Nota de prueba número {i}"}
+
+
+def fill(store, start, end, users):
+    batch = 50000
+    for lo in range(start, end, batch):
+        hi = min(end, lo + batch)
+        store.append_many((str(random.randrange(users)), make_entry(i)) for i in range(lo, hi))
+
+
+def measure(store, users):
+    t0 = time.perf_counter()
+    for i in range(SAMPLES):
+        store.append(str(random.randrange(users)), make_entry(i))
+    save_us = (time.perf_counter() - t0) / SAMPLES * 1e6
+    t0 = time.perf_counter()
+    for _ in range(SAMPLES):
+        store.recent(str(random.randrange(users)), 10)
+    read_us = (time.perf_counter() - t0) / SAMPLES * 1e6
+    return save_us, read_us
+
+
+def bench_store(name, store, sizes, users):
+    stored = 0
+    for size in sizes:
+        fill(store, stored, size, users)
+        stored = store.count()
+        save_us, read_us = measure(store, users)
+        print(f"{name:8} {stored:>9,} notas  guardar {save_us:9.1f} µs  leer {read_us:9.1f} µs")
+    store.close()
+
+
+def bench_legacy(path, sizes, users):
+    for size in (s for s in sizes if s <= 10000):
+        notes = {}
+        for i in range(size):
+            notes.setdefault(str(random.randrange(users)), []).append(make_entry(i))
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(notes, f, ensure_ascii=False, indent=2)
+        samples = 20
+        t0 = time.perf_counter()
+        for i in range(samples):
+            with open(path, "r", encoding="utf-8") as f:
+                notes = json.load(f)
+            notes.setdefault(str(random.randrange(users)), []).append(make_entry(i))
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(notes, f, ensure_ascii=False, indent=2)
+        save_us = (time.perf_counter() - t0) / samples * 1e6
+        t0 = time.perf_counter()
+        for _ in range(samples):
+            with open(path, "r", encoding="utf-8") as f:
+                notes = json.load(f)
+            notes.get(str(random.randrange(users)), [])[-10:][::-1]
+        read_us = (time.perf_counter() - t0) / samples * 1e6
+        print(f"{'json':8} {size:>9,} notas  guardar {save_us:9.1f} µs  leer {read_us:9.1f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_store("sqlite", SQLiteNoteStore(os.path.join(tmp, "notes.db")), sizes, args.users)
+        bench_store("log", LogNoteStore(os.path.join(tmp, "notes.log")), sizes, args.users)
+        if args.legacy:
+            bench_legacy(os.path.join(tmp, "user_notes.json"), sizes, args.users)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Arranque en frío: tiempo de importación y tiempo hasta la primera respuesta.
+
+Uso: python benchmarks/bench_startup.py [--runs 5] [--cold]
+
+1. Ejecuta `python -X importtime -c "import main"` varias veces y muestra la
+   mediana del total y de los módulos importados directamente por main.py.
+2. Lanza `python main.py` contra una Bot API falsa local (TELEGRAM_API_URL)
+   con un /luna ya en cola y mide desde que arranca el proceso hasta que la
+   Bot API recibe la respuesta. Con --cold el proceso arranca sin tabla de
+   efemérides ni snapshot de contenido, como un contenedor recién creado.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import FakeBotAPI, command_update
+
+CHAT_ID = 4242
+
+
+def import_times(runs):
+    """Mediana (µs) del tiempo acumulado de main y de cada import directo de main."""
+    samples = {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT,
+                                env=dict(os.environ, TELEGRAM_TOKEN="1:bench"), capture_output=True, text=True)
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            # Dos espacios de sangría: importado directamente por main.
+            if name.rstrip() == " main" or (name.startswith("   ") and not name.startswith("     ")):
+                samples.setdefault(name.strip(), []).append(int(cumulative))
+    return {name: statistics.median(values) for name, values in samples.items()}
+
+
+async def first_reply(env, timeout=60):
+    api = await FakeBotAPI().start()
+    api.push_update(command_update(1, CHAT_ID, "/luna"))
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "main.py", cwd=ROOT, env=dict(env, TELEGRAM_API_URL=api.base_url),
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        deadline = started + timeout
+        while str(CHAT_ID) not in api.replies and time.monotonic() < deadline:
+            await asyncio.sleep(0.001)
+        if str(CHAT_ID) not in api.replies:
+            raise RuntimeError("el bot no respondió a tiempo")
+        return api.replies[str(CHAT_ID)] - started
+    finally:
+        process.terminate()
+        await process.wait()
+        await api.stop()
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            TELEGRAM_TOKEN="1:bench",
+            NOTES_DB_PATH=os.path.join(tmp, "notes.db"),
+            BROADCAST_DB_PATH=os.path.join(tmp, "broadcast.db"),
+            PERSISTENCE_PATH=os.path.join(tmp, "bot_state.db"),
+            MOON_TIMES_PATH=os.path.join(tmp, "moon_times.snapshot"),
+        )
+        times = []
+        for run_number in range(args.runs):
+            if args.cold:
+                # Rutas nuevas en cada arranque: no hay nada generado de antes.
+                env["EPHEMERIS_PATH"] = os.path.join(tmp, f"moon_ephemeris-{run_number}.bin")
+                env["CONTENT_SNAPSHOT_PATH"] = os.path.join(tmp, f"content-{run_number}.snapshot")
+                env["MOON_TIMES_PATH"] = os.path.join(tmp, f"moon_times-{run_number}.snapshot")
+            times.append(await first_reply(env))
+        return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cold", action="store_true", help="sin tabla de efemérides ni snapshot de contenido")
+    args = parser.parse_args()
+
+    imports = import_times(args.runs)
+    total = imports.pop("main")
+    print(f"import main: {total / 1000:7.1f} ms (mediana de {args.runs})")
+    for name, value in sorted(imports.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {name:20} {value / 1000:7.1f} ms")
+
+    times = asyncio.run(run(args))
+    label = "en frío" if args.cold else "con caché en disco"
+    print(f"primera respuesta ({label}): mediana {statistics.median(times) * 1000:7.1f} ms  "
+          f"mín {min(times) * 1000:7.1f} ms  máx {max(times) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Prueba de carga: polling frente a webhook con updates sintéticas.
+
+Uso: python benchmarks/bench_webhook.py [--updates 2000] [--concurrency 32] [--api-latency 0.05]
+
+Levanta una Bot API falsa local (con `--api-latency` segundos por respuesta,
+para simular la ida y vuelta a Telegram) y la aplicación real de main.py.
+En modo polling las updates se entregan por getUpdates; en modo webhook un
+cliente local las envía por POST al WebhookServer, reintentando tras los 429
+como hace Telegram. La latencia va desde que la update se inyecta hasta que
+la Bot API falsa recibe la respuesta del bot.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123:fake")
+
+from fake_bot_api import FakeBotAPI, command_update
+
+COMMANDS = ["/luna", "/mantra amor", "/meditacion proyectos", "/conjuro proteccion", "/start"]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(mode, api, injected, started):
+    latencies = [(api.replies[str(chat_id)] - t) * 1000 for chat_id, t in injected.items()]
+    elapsed = max(api.replies.values()) - started
+    print(f"{mode:8} {len(latencies) / elapsed:8.0f} updates/s   p50 {percentile(latencies, 50):7.1f} ms   "
+          f"p99 {percentile(latencies, 99):7.1f} ms")
+
+
+async def wait_replies(api, n, timeout=300):
+    deadline = time.monotonic() + timeout
+    while len(api.replies) < n and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def bench_polling(main, n, concurrency, api_latency):
+    api = await FakeBotAPI(latency=api_latency).start()
+    application = main.build_application("polling", concurrency, base_url=api.base_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+    await application.start()
+    injected = {}
+    started = time.monotonic()
+    for i in range(n):
+        chat_id = 1000 + i
+        injected[chat_id] = time.monotonic()
+        api.push_update(command_update(i + 1, chat_id, COMMANDS[i % len(COMMANDS)]))
+    await wait_replies(api, n)
+    report("polling", api, injected, started)
+    await application.updater.stop()
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+
+
+async def bench_webhook(main, n, concurrency, api_latency, queue_size, clients):
+    api = await FakeBotAPI(latency=api_latency).start()
+    application = main.build_application("webhook", concurrency, base_url=api.base_url)
+    server = await main.start_webhook(application, 0, concurrency, queue_size)
+    injected = {}
+    pending = asyncio.Queue()
+    for i in range(n):
+        pending.put_nowait((i + 1, 1000 + i))
+    rejected = 0
+
+    async def client():
+        # Cliente HTTP/1.1 keep-alive mínimo: httpx consume más CPU que el propio bot.
+        nonlocal rejected
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        while not pending.empty():
+            update_id, chat_id = pending.get_nowait()
+            injected.setdefault(chat_id, time.monotonic())
+            body = json.dumps(command_update(update_id, chat_id, COMMANDS[update_id % len(COMMANDS)])).encode()
+            while True:
+                writer.write(f"POST {server.path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                status = int((await reader.readline()).split()[1])
+                length = 0
+                while (line := await reader.readline()) != b"\r\n":
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                await reader.readexactly(length)
+                if status != 429:
+                    break
+                rejected += 1
+                await asyncio.sleep(0.05)
+        writer.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    await wait_replies(api, n)
+    report("webhook", api, injected, started)
+    print(f"         {rejected} respuestas 429 (cola de {queue_size})")
+    await main.stop_webhook(application, server)
+    await api.stop()
+
+
+async def run(args):
+    import main
+    await bench_polling(main, args.updates, args.concurrency, args.api_latency)
+    await bench_webhook(main, args.updates, args.concurrency, args.api_latency, args.queue_size, args.clients)
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=40, help="conexiones simultáneas del cliente webhook")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["NOTES_DB_PATH"] = os.path.join(tmp, "notes.db")
+        os.environ["BROADCAST_DB_PATH"] = os.path.join(tmp, "broadcast.db")
+        os.environ["PERSISTENCE_PATH"] = os.path.join(tmp, "bot_state.db")
+        os.environ["MOON_TIMES_PATH"] = os.path.join(tmp, "moon_times.snapshot")
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    cli()
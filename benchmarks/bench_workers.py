@@ -0,0 +1,171 @@
+"""Rendimiento con varios procesos: runner.py con 1, 2, 4 y 8 workers.
+
+Uso: python benchmarks/bench_workers.py [--workers 1 2 4 8] [--users 200] [--rounds 3] [--api-latency 0.05] [--think 0]
+
+Para cada número de workers lanza `runner.py --mode webhook` contra una Bot
+API falsa local y simula usuarias que escriben de forma secuencial (cada
+mensaje espera la respuesta del anterior): /luna, /anotar, el texto de la
+nota y /mantra, `--rounds` veces, con una pausa opcional de `--think`
+segundos tras cada respuesta. Sin pausa, el texto de la nota llega justo
+cuando /anotar acaba de responder: cada worker procesa las updates de un
+mismo chat de una en una, así que no se pierde. Mide updates/s y la latencia por mensaje,
+y al final comprueba que se han guardado todas las notas: si una
+conversación cayera en un worker que no conoce su estado, la nota se
+perdería. Con una sola CPU los workers compiten entre sí y no se ve el
+escalado; hay que ejecutarlo en una máquina con varios núcleos.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import FakeBotAPI, command_update
+from http_server import HTTPConnectionPool
+
+FIRST_CHAT = 5000
+WORKER_PORT = 28443
+REPLY_TIMEOUT = 30
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def conversation(round_number):
+    return ["/luna", "/anotar", f"Avance {round_number} de la semana", "/mantra amor"]
+
+
+class Client:
+    """Envía las updates al runner como Telegram: reintenta tras 429/503."""
+
+    def __init__(self, port, connections):
+        self.pool = HTTPConnectionPool("127.0.0.1", port, connections)
+        self.update_id = 0
+
+    async def send(self, chat_id, text):
+        self.update_id += 1
+        body = json.dumps(command_update(self.update_id, chat_id, text)).encode()
+        while True:
+            response = await self.pool.request("POST", "/webhook", body, {"Content-Type": "application/json"})
+            if response.status == 200:
+                return
+            await asyncio.sleep(float(response.headers.get("retry-after", 0.1)))
+
+
+async def user(api, client, chat_id, rounds, think, latencies):
+    """Devuelve False si algún mensaje se queda sin respuesta."""
+    sent = 0
+    for round_number in range(rounds):
+        for text in conversation(round_number):
+            t0 = time.monotonic()
+            await client.send(chat_id, text)
+            sent += 1
+            try:
+                await asyncio.wait_for(api.wait_sent(chat_id, sent), REPLY_TIMEOUT)
+            except asyncio.TimeoutError:
+                return False
+            latencies.append((time.monotonic() - t0) * 1000)
+            await asyncio.sleep(think)
+    return True
+
+
+async def wait_port(port, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.returncode is not None:
+            raise RuntimeError(f"runner.py terminó con código {process.returncode}")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError("runner.py no arrancó a tiempo")
+            await asyncio.sleep(0.05)
+
+
+async def bench(workers, args, tmp):
+    api = await FakeBotAPI(latency=args.api_latency).start()
+    notes_path = os.path.join(tmp, f"notes-{workers}.db")
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN="1:bench",
+        TELEGRAM_API_URL=api.base_url,
+        NOTES_BACKEND="sqlite",
+        NOTES_DB_PATH=notes_path,
+        BROADCAST_DB_PATH=os.path.join(tmp, f"broadcast-{workers}.db"),
+        PERSISTENCE_PATH=os.path.join(tmp, f"bot_state-{workers}.db"),
+        MOON_TIMES_PATH=os.path.join(tmp, "moon_times.snapshot"),
+    )
+    env.pop("WEBHOOK_URL", None)
+    env.pop("WEBHOOK_SECRET", None)
+    port = free_port()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "runner.py", "--mode", "webhook", "--workers", str(workers), "--port", str(port),
+        "--worker-port", str(WORKER_PORT), "--concurrency", str(args.concurrency),
+        cwd=ROOT, env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    client = Client(port, args.connections)
+    try:
+        await wait_port(port, process)
+        latencies = []
+        started = time.monotonic()
+        finished = await asyncio.gather(*(user(api, client, FIRST_CHAT + i, args.rounds, args.think, latencies) for i in range(args.users)))
+        elapsed = time.monotonic() - started
+    finally:
+        await client.pool.close()
+        if process.returncode is None:
+            process.send_signal(signal.SIGTERM)
+        await process.wait()
+        await api.stop()
+
+    with sqlite3.connect(notes_path) as conn:
+        notes = conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+    expected = args.users * args.rounds
+    stuck = finished.count(False)
+    ok = notes == expected and not stuck
+    status = "ok" if ok else f"FALTAN {expected - notes} ({stuck} usuarias sin respuesta)"
+    print(f"{workers:2} workers  {len(latencies) / elapsed:7.0f} updates/s   p50 {percentile(latencies, 50):6.1f} ms   "
+          f"p99 {percentile(latencies, 99):6.1f} ms   notas {notes}/{expected} {status}")
+    return ok
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [await bench(workers, args, tmp) for workers in args.workers]
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--users", type=int, default=200, help="usuarias simultáneas")
+    parser.add_argument("--rounds", type=int, default=3, help="notas por usuaria")
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    parser.add_argument("--think", type=float, default=0.0, help="pausa entre respuesta y siguiente mensaje")
+    parser.add_argument("--concurrency", type=int, default=32, help="updates en paralelo por worker")
+    parser.add_argument("--connections", type=int, default=64, help="conexiones del cliente con el runner")
+    args = parser.parse_args()
+    print(f"CPUs: {os.cpu_count()}")
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
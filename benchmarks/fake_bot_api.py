@@ -0,0 +1,149 @@
+"""Servidor local que imita la Bot API de Telegram para benchmarks.
+
+Responde a getMe, sendMessage y getUpdates sin límites reales; con
+`retry_after_every=N` contesta un 429 (RetryAfter) cada N envíos para
+ejercitar los reintentos. Se usa con `Bot(token, base_url=api.base_url)`.
+Las updates que se añaden con `push_update` se entregan por getUpdates
+(modo polling); `wait_sent` espera a que un chat haya recibido N mensajes.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+from collections import Counter
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_server import HTTPServer, Response
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LUN.IA test", "username": "lun_ia_test_bot"}
+
+
+def command_update(update_id, chat_id, text):
+    """Update sintética de un mensaje privado con un comando."""
+    command = text.split()[0]
+    user = {"id": chat_id, "is_bot": False, "first_name": f"Usuaria {chat_id}", "username": f"user{chat_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}] if command.startswith("/") else [],
+        },
+    }
+
+
+class FakeBotAPI:
+    def __init__(self, retry_after_every=0, retry_after=1, latency=0.0):
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.latency = latency
+        self.sent = Counter()
+        self.sent_at = []
+        self.replies = {}
+        self.requests = 0
+        self.updates = asyncio.Queue()
+        self._polling = 0
+        self._waiters = {}
+        self._http = HTTPServer(self._handle)
+
+    @property
+    def port(self):
+        return self._http.port
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self, port=0):
+        self._http.port = port
+        await self._http.start()
+        return self
+
+    async def stop(self):
+        # Despierta los getUpdates en espera para que sus conexiones terminen
+        # solas y no queden tareas canceladas al cerrar el event loop.
+        for _ in range(self._polling):
+            self.updates.put_nowait(None)
+        await asyncio.sleep(0.01)
+        await self._http.stop()
+
+    def push_update(self, update):
+        self.updates.put_nowait(update)
+
+    async def wait_sent(self, chat_id, count):
+        """Espera a que se hayan enviado `count` mensajes al chat."""
+        chat_id = str(chat_id)
+        if self.sent[chat_id] >= count:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append((count, future))
+        await future
+
+    def _notify(self, chat_id):
+        pending = []
+        for count, future in self._waiters.pop(chat_id, ()):
+            if self.sent[chat_id] >= count:
+                if not future.done():
+                    future.set_result(None)
+            else:
+                pending.append((count, future))
+        if pending:
+            self._waiters[chat_id] = pending
+
+    async def _handle(self, request):
+        method = request.path.rsplit("/", 1)[-1]
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            params = json.loads(request.body or b"{}")
+        else:
+            params = dict(parse_qsl(request.body.decode()))
+        status, payload = await self._dispatch(method, params)
+        return Response(status, json.dumps(payload).encode(), {"Content-Type": "application/json"})
+
+    async def _dispatch(self, method, params):
+        self.requests += 1
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(float(params.get("timeout", 0)))}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method == "sendMessage":
+            if self.retry_after_every and self.requests % self.retry_after_every == 0:
+                return 429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            chat_id = params["chat_id"]
+            self.sent[chat_id] += 1
+            now = time.monotonic()
+            self.sent_at.append(now)
+            self.replies.setdefault(chat_id, now)
+            if chat_id in self._waiters:
+                self._notify(chat_id)
+            chat = {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else -100, "type": "private"}
+            return 200, {"ok": True, "result": {
+                "message_id": self.requests, "date": int(time.time()), "chat": chat, "text": params.get("text", ""),
+            }}
+        return 200, {"ok": True, "result": True}
+
+    async def _get_updates(self, timeout):
+        self._polling += 1
+        try:
+            batch = [await asyncio.wait_for(self.updates.get(), timeout or 0.01)]
+        except asyncio.TimeoutError:
+            return []
+        finally:
+            self._polling -= 1
+        if batch[0] is None:
+            return []
+        while len(batch) < 100 and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
@@ -0,0 +1,83 @@
+"""Update/Context falsos y ligeros para llamar a los handlers sin Telegram.
+
+Solo implementan lo que usan los handlers de main.py (salvo los botones
+de /logros, que llegan como callback_query): `update.message`,
+`update.effective_user`, `update.effective_chat`, `context.args` y
+`context.bot_data`. Las respuestas se guardan en un StubBot.
+"""
+from collections import namedtuple
+
+Reply = namedtuple("Reply", "chat_id text kwargs")
+
+
+class StubBot:
+    def __init__(self):
+        self.replies = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.replies.append(Reply(chat_id, text, kwargs))
+
+    async def send_document(self, chat_id, document, **kwargs):
+        # Como la Bot API real: el fichero se lee entero para subirlo.
+        self.replies.append(Reply(chat_id, document.read(), kwargs))
+
+
+class FakeUser:
+    __slots__ = ("id", "username", "first_name")
+
+    def __init__(self, user_id, username=None):
+        self.id = user_id
+        self.username = username or f"user{user_id}"
+        self.first_name = self.username
+
+
+class FakeChat:
+    __slots__ = ("id", "type")
+
+    def __init__(self, chat_id):
+        self.id = chat_id
+        self.type = "private"
+
+
+class FakeMessage:
+    __slots__ = ("chat", "from_user", "text", "_bot")
+
+    def __init__(self, bot, chat, user, text):
+        self._bot = bot
+        self.chat = chat
+        self.from_user = user
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        await self._bot.send_message(self.chat.id, text, **kwargs)
+
+    async def reply_document(self, document, **kwargs):
+        await self._bot.send_document(self.chat.id, document, **kwargs)
+
+
+class FakeUpdate:
+    __slots__ = ("message", "effective_user", "effective_chat", "effective_message")
+
+    def __init__(self, bot, user_id, text="", username=None):
+        user = FakeUser(user_id, username)
+        chat = FakeChat(user_id)
+        self.effective_user = user
+        self.effective_chat = chat
+        self.message = self.effective_message = FakeMessage(bot, chat, user, text)
+
+
+class FakeContext:
+    __slots__ = ("bot", "args", "bot_data", "user_data", "error")
+
+    def __init__(self, bot, bot_data, args=None, user_data=None):
+        self.bot = bot
+        self.bot_data = bot_data
+        self.user_data = {} if user_data is None else user_data
+        self.args = args or []
+        self.error = None
+
+
+def make_call(bot, bot_data, user_id, text, username=None, user_data=None):
+    """(update, context) para un mensaje `text`; los args salen como en CommandHandler."""
+    args = text.split()[1:] if text.startswith("/") else []
+    return FakeUpdate(bot, user_id, text, username), FakeContext(bot, bot_data, args, user_data)
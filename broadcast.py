@@ -0,0 +1,329 @@
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = "broadcast.db"
+GLOBAL_RATE = 30
+PER_CHAT_INTERVAL = 1.0
+CONCURRENCY = 20
+BATCH_SIZE = 500
+MAX_RETRIES = 5
+
+
+class SubscriberStore:
+    """Suscriptores y progreso de los envíos masivos, en SQLite.
+
+    Igual que el almacén de notas, el trabajo de disco se hace en un hilo
+    aparte; aquí basta uno porque las operaciones son pequeñas y secuenciales.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="subscribers")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS subscribers (
+                chat_id INTEGER PRIMARY KEY,
+                since TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                broadcast_id TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                channel_sent INTEGER NOT NULL DEFAULT 0,
+                last_chat_id INTEGER NOT NULL DEFAULT -9223372036854775808,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                done INTEGER NOT NULL DEFAULT 0
+            );
+            -- Chats ya atendidos más allá de last_chat_id (un lote interrumpido a medias).
+            CREATE TABLE IF NOT EXISTS broadcast_finished (
+                broadcast_id TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                PRIMARY KEY (broadcast_id, chat_id)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _update(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).rowcount
+
+    def add(self, chat_id):
+        """Devuelve False si el chat ya estaba suscrito."""
+        return self._update(
+            "INSERT OR IGNORE INTO subscribers (chat_id, since) VALUES (?, ?)",
+            (chat_id, datetime.now().isoformat(timespec="seconds")),
+        ) == 1
+
+    def add_many(self, chat_ids):
+        since = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO subscribers (chat_id, since) VALUES (?, ?)",
+                ((chat_id, since) for chat_id in chat_ids),
+            )
+
+    def remove(self, chat_id):
+        return self._update("DELETE FROM subscribers WHERE chat_id = ?", (chat_id,)) == 1
+
+    def count(self):
+        return self._query("SELECT COUNT(*) FROM subscribers")[0][0]
+
+    def batch_after(self, chat_id, limit):
+        rows = self._query(
+            "SELECT chat_id FROM subscribers WHERE chat_id > ? ORDER BY chat_id LIMIT ?", (chat_id, limit)
+        )
+        return [r[0] for r in rows]
+
+    def start_broadcast(self, broadcast_id, text):
+        """Registra un envío (si no existía) y devuelve su estado guardado."""
+        self._update("INSERT OR IGNORE INTO broadcasts (broadcast_id, text) VALUES (?, ?)", (broadcast_id, text))
+        return self.get_broadcast(broadcast_id)
+
+    def get_broadcast(self, broadcast_id):
+        rows = self._query(
+            "SELECT text, channel_sent, last_chat_id, sent, failed, done FROM broadcasts WHERE broadcast_id = ?",
+            (broadcast_id,),
+        )
+        if not rows:
+            return None
+        keys = ("text", "channel_sent", "last_chat_id", "sent", "failed", "done")
+        return dict(zip(keys, rows[0]), broadcast_id=broadcast_id)
+
+    def pending_broadcasts(self):
+        return [r[0] for r in self._query("SELECT broadcast_id FROM broadcasts WHERE done = 0")]
+
+    def close_broadcast(self, broadcast_id):
+        """Da por terminado un envío sin completar (su texto ya no vale)."""
+        self._update("UPDATE broadcasts SET done = 1 WHERE broadcast_id = ?", (broadcast_id,))
+
+    def mark_channel_sent(self, broadcast_id):
+        self._update("UPDATE broadcasts SET channel_sent = 1 WHERE broadcast_id = ?", (broadcast_id,))
+
+    def checkpoint(self, broadcast_id, last_chat_id, sent, failed, done=False, finished=()):
+        """Avanza el cursor del envío y anota los chats de `finished`, ya atendidos aunque estén más allá."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE broadcasts SET last_chat_id = ?, sent = sent + ?, failed = failed + ?, done = ? "
+                "WHERE broadcast_id = ?",
+                (last_chat_id, sent, failed, int(done), broadcast_id),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO broadcast_finished (broadcast_id, chat_id) VALUES (?, ?)",
+                ((broadcast_id, chat_id) for chat_id in finished),
+            )
+            # Lo que ya cubre el cursor no hace falta recordarlo.
+            self._conn.execute(
+                "DELETE FROM broadcast_finished WHERE broadcast_id = ? AND (chat_id <= ? OR ?)",
+                (broadcast_id, last_chat_id, int(done)),
+            )
+
+    def finished_after(self, broadcast_id, chat_id):
+        rows = self._query(
+            "SELECT chat_id FROM broadcast_finished WHERE broadcast_id = ? AND chat_id > ?", (broadcast_id, chat_id)
+        )
+        return {r[0] for r in rows}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+
+class TokenBucket:
+    """Limitador de tasa compartido: `rate` envíos por segundo con ráfagas de `capacity`.
+
+    `rate=0` desactiva el límite (útil en benchmarks contra un servidor local).
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Detiene todos los envíos `seconds` segundos (tras un RetryAfter de Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatRateLimiter:
+    """Intervalo mínimo entre mensajes al mismo chat."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_allowed = {}
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        start = max(now, self._next_allowed.get(chat_id, 0))
+        self._next_allowed[chat_id] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+        if len(self._next_allowed) > 10000:
+            self._next_allowed = {k: v for k, v in self._next_allowed.items() if v > now}
+
+
+class Broadcaster:
+    """Envía un mensaje al canal y después a todos los suscriptores.
+
+    Los suscriptores se recorren por chat_id en lotes; tras cada lote se
+    guarda el último chat_id enviado, así que un reinicio reanuda el envío
+    donde se quedó. Con `stop()` no se empiezan más envíos, se esperan los
+    que están en marcha y se guardan también los chats ya atendidos del lote
+    a medias: al reanudar no se repite ninguno. Si la tarea se cancela, solo
+    se pueden repetir los envíos que estaban en vuelo; si el proceso muere
+    sin parada ordenada, como mucho se repite el lote en curso.
+    """
+
+    def __init__(self, bot, store, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL,
+                 concurrency=CONCURRENCY, batch_size=BATCH_SIZE, max_retries=MAX_RETRIES):
+        self.bot = bot
+        self.store = store
+        self.bucket = TokenBucket(rate)
+        self.chat_limiter = ChatRateLimiter(per_chat_interval)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        """Parada ordenada: termina los envíos en curso, guarda el progreso y `run` vuelve sin completar."""
+        self._stopping.set()
+
+    async def run(self, broadcast_id, text, channel=None):
+        state = await self.store.run(self.store.start_broadcast, broadcast_id, text)
+        return await self._run(state, channel)
+
+    async def resume(self, broadcast_id, channel=None):
+        """Reanuda un envío interrumpido con el texto que se guardó al empezarlo."""
+        state = await self.store.run(self.store.get_broadcast, broadcast_id)
+        return await self._run(state, channel)
+
+    async def _run(self, state, channel):
+        broadcast_id, text = state["broadcast_id"], state["text"]
+        if state["done"]:
+            logger.info(f"Envío {broadcast_id} ya completado")
+            return state
+        if channel and not state["channel_sent"]:
+            if await self._send(channel, text) is None:
+                return state
+            await self.store.run(self.store.mark_channel_sent, broadcast_id)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_one(i, chat_id):
+            async with semaphore:
+                if not self._stopping.is_set():
+                    outcomes[i] = await self._send(chat_id, text, subscriber=True)
+
+        last_chat_id = state["last_chat_id"]
+        # Chats del lote que se interrumpió la última vez y que ya se atendieron.
+        finished = await self.store.run(self.store.finished_after, broadcast_id, last_chat_id)
+        started = time.monotonic()
+        while True:
+            batch = await self.store.run(self.store.batch_after, last_chat_id, self.batch_size)
+            if not batch:
+                break
+            pending = [chat_id for chat_id in batch if chat_id not in finished] if finished else batch
+            outcomes = [None] * len(pending)
+            try:
+                await asyncio.gather(*(send_one(i, chat_id) for i, chat_id in enumerate(pending)))
+            except asyncio.CancelledError:
+                await self._save_partial(broadcast_id, last_chat_id, pending, outcomes)
+                raise
+            if self._stopping.is_set():
+                await self._save_partial(broadcast_id, last_chat_id, pending, outcomes)
+                logger.info(f"Envío {broadcast_id} detenido; se reanudará donde se quedó")
+                return await self.store.run(self.store.get_broadcast, broadcast_id)
+            last_chat_id = batch[-1]
+            sent = sum(outcomes)
+            await self.store.run(self.store.checkpoint, broadcast_id, last_chat_id, sent, len(outcomes) - sent)
+        await self.store.run(self.store.checkpoint, broadcast_id, last_chat_id, 0, 0, True)
+        state = await self.store.run(self.store.get_broadcast, broadcast_id)
+        logger.info(
+            f"Envío {broadcast_id} completado: {state['sent']} enviados, {state['failed']} fallidos "
+            f"en {time.monotonic() - started:.1f} s"
+        )
+        return state
+
+    async def _save_partial(self, broadcast_id, last_chat_id, pending, outcomes):
+        # El tramo inicial ya atendido avanza el cursor; el resto de atendidos se anota aparte.
+        done = next((i for i, outcome in enumerate(outcomes) if outcome is None), len(outcomes))
+        if done:
+            last_chat_id = pending[done - 1]
+        finished = [chat_id for chat_id, outcome in zip(pending[done:], outcomes[done:]) if outcome is not None]
+        results = [outcome for outcome in outcomes if outcome is not None]
+        sent = sum(results)
+        await self.store.run(self.store.checkpoint, broadcast_id, last_chat_id, sent, len(results) - sent,
+                             False, finished)
+
+    async def _send(self, chat_id, text, subscriber=False):
+        """True si se envió, False si se descarta y None si se detuvo el envío antes de mandarlo."""
+        for attempt in range(self.max_retries):
+            await self.bucket.acquire()
+            await self.chat_limiter.acquire(chat_id)
+            if self._stopping.is_set():
+                return None
+            try:
+                await self.bot.send_message(chat_id, text)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Límite de Telegram alcanzado, esperando {e.retry_after} s")
+                self.bucket.pause(e.retry_after)
+            except Forbidden:
+                # El usuario bloqueó el bot: no tiene sentido seguir enviándole.
+                if subscriber:
+                    await self.store.run(self.store.remove, chat_id)
+                return False
+            except BadRequest as e:
+                logger.error(f"Envío a {chat_id} rechazado: {e}")
+                return False
+            except NetworkError:
+                # La espera se corta si se detiene el envío.
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), min(30, 2 ** attempt))
+                except asyncio.TimeoutError:
+                    pass
+            except TelegramError as e:
+                logger.error(f"Error enviando a {chat_id}: {e}")
+                return False
+        logger.error(f"Envío a {chat_id} abandonado tras {self.max_retries} intentos")
+        return False
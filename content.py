@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import json.scanner
+import random
+import marshal
+import asyncio
+import logging
+import unicodedata
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+MOON_DATA_PATH = "moon_data.json"
+MOON_SCIENCE_PATH = "moon_science_data.json"
+RITUALS_PATH = "rituals_db.json"
+CONTENT_FILES = (MOON_DATA_PATH, MOON_SCIENCE_PATH, RITUALS_PATH)
+CONTENT_SNAPSHOT_PATH = "content.snapshot"
+SNAPSHOT_FORMAT = 1
+POLL_INTERVAL = 2.0
+
+MOON_PHASE_NAMES = ["Luna Nueva", "Cuarto Creciente", "Luna Llena", "Cuarto Menguante"]
+
+# Tipo de contenido en rituals_db.json -> comando que lo sirve.
+KIND_COMMANDS = {"meditaciones": "meditacion", "mantras": "mantra", "conjuros": "conjuro"}
+SCIENCE_FIELDS = ("curiosidad", "ritual_breve", "momentos_propicios")
+
+
+class ContentError(ValueError):
+    """Los ficheros de contenido no cumplen el esquema esperado."""
+
+
+def normalize_theme(theme):
+    """'Protección' -> 'proteccion': minúsculas y sin tildes."""
+    decomposed = unicodedata.normalize("NFKD", theme.strip().lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _is_text_list(value):
+    return isinstance(value, list) and value and all(isinstance(v, str) and v.strip() for v in value)
+
+
+def _validate(moon_data, science, rituals, phases):
+    errors = []
+    for name, data in (("moon_data", moon_data), ("moon_science_data", science), ("rituals_db", rituals)):
+        if not isinstance(data, dict):
+            errors.append(f"{name}: se esperaba un objeto JSON")
+    if errors:
+        raise ContentError("\n".join(errors))
+
+    for phase in phases:
+        fields = science.get(phase)
+        if not isinstance(fields, dict):
+            errors.append(f"moon_science_data: falta la fase '{phase}'")
+            continue
+        for field in SCIENCE_FIELDS:
+            if not isinstance(fields.get(field), str) or not fields[field].strip():
+                errors.append(f"moon_science_data['{phase}']: falta '{field}'")
+
+    for phase, sections in moon_data.items():
+        if not isinstance(sections, dict) or not all(_is_text_list(v) for v in sections.values()):
+            errors.append(f"moon_data['{phase}']: cada sección debe ser una lista de textos")
+
+    for phase, kinds in rituals.items():
+        if phase not in phases:
+            errors.append(f"rituals_db: fase desconocida '{phase}'")
+            continue
+        if not isinstance(kinds, dict):
+            errors.append(f"rituals_db['{phase}']: se esperaba un objeto")
+            continue
+        for kind, themes in kinds.items():
+            if kind not in KIND_COMMANDS:
+                errors.append(f"rituals_db['{phase}']: tipo desconocido '{kind}'")
+                continue
+            if not isinstance(themes, dict):
+                errors.append(f"rituals_db['{phase}']['{kind}']: se esperaba un objeto")
+                continue
+            seen = {}
+            for theme, items in themes.items():
+                if not _is_text_list(items):
+                    errors.append(f"rituals_db['{phase}']['{kind}']['{theme}']: debe ser una lista de textos no vacía")
+                alias = normalize_theme(theme)
+                if alias in seen:
+                    errors.append(f"rituals_db['{phase}']['{kind}']: '{theme}' y '{seen[alias]}' se confunden")
+                seen[alias] = theme
+    if errors:
+        raise ContentError("\n".join(errors))
+
+
+def _compile(moon_data, science, rituals, phases):
+    """Estructuras del índice como dicts, tuplas y cadenas (serializables con marshal)."""
+    entries = {}
+    available = {}
+    all_themes = {kind: {} for kind in KIND_COMMANDS}
+    for phase, kinds in rituals.items():
+        for kind, themes in kinds.items():
+            for theme, items in themes.items():
+                entries[(phase, kind, normalize_theme(theme))] = (theme, tuple(items))
+                all_themes[kind].setdefault(theme, None)
+            available[(phase, kind)] = ", ".join(themes)
+    help_texts = {
+        kind: f"Uso: /{command} [tema]\nTemas disponibles: {', '.join(all_themes[kind])}"
+        for kind, command in KIND_COMMANDS.items()
+    }
+    return (
+        {phase: {k: tuple(v) for k, v in sections.items()} for phase, sections in moon_data.items()},
+        {phase: dict(science[phase]) for phase in phases},
+        entries,
+        available,
+        help_texts,
+    )
+
+
+class ContentIndex:
+    """Contenido compilado e inmutable.
+
+    Los textos de cada (fase, tipo, tema) se guardan en tuplas bajo el alias
+    normalizado del tema, y las cadenas de ayuda ("Temas disponibles: ...")
+    se calculan una sola vez al compilar.
+    """
+
+    __slots__ = ("moon_data", "science", "_entries", "_available", "_help", "version")
+
+    def __init__(self, moon_data, science, rituals, phases, version=0):
+        _validate(moon_data, science, rituals, phases)
+        self._set(_compile(moon_data, science, rituals, phases), version)
+
+    @classmethod
+    def from_compiled(cls, compiled, version=0):
+        """Índice a partir de la salida de `_compile` ya validada (p. ej. de un snapshot)."""
+        index = cls.__new__(cls)
+        index._set(compiled, version)
+        return index
+
+    def _set(self, compiled, version):
+        moon_data, science, entries, available, help_texts = compiled
+        self.moon_data = MappingProxyType({phase: MappingProxyType(sections) for phase, sections in moon_data.items()})
+        self.science = MappingProxyType({phase: MappingProxyType(fields) for phase, fields in science.items()})
+        self._entries = MappingProxyType(entries)
+        self._available = MappingProxyType(available)
+        self._help = MappingProxyType(help_texts)
+        self.version = version
+
+    def __setattr__(self, name, value):
+        if hasattr(self, "version"):
+            raise AttributeError("ContentIndex es inmutable")
+        object.__setattr__(self, name, value)
+
+    def lookup(self, phase, kind, theme):
+        """Devuelve (tema canónico, textos) o None si no hay contenido para ese tema."""
+        return self._entries.get((phase, kind, normalize_theme(theme)))
+
+    def choice(self, phase, kind, theme):
+        found = self.lookup(phase, kind, theme)
+        if found is None:
+            return None
+        return found[0], random.choice(found[1])
+
+    def available(self, phase, kind):
+        """Temas disponibles para la fase ya formateados, o None si no hay ninguno."""
+        return self._available.get((phase, kind))
+
+    def help(self, kind):
+        return self._help[kind]
+
+
+def _read_json(path, cooperative=False):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if not cooperative:
+        return json.loads(text)
+    # El parser en C no suelta el GIL hasta terminar: con un fichero grande
+    # congelaría el event loop decenas de ms. El escáner en Python puro es más
+    # lento, pero el intérprete cambia de hilo cada pocos ms mientras trabaja.
+    decoder = json.JSONDecoder()
+    decoder.scan_once = json.scanner.py_make_scanner(decoder)
+    return decoder.decode(text)
+
+
+def load_content(paths=CONTENT_FILES, phases=(), version=0, cooperative=False):
+    data = [_read_json(path, cooperative) for path in paths]
+    return ContentIndex(*data, phases=phases, version=version)
+
+
+def _stat(paths):
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamps.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamps.append(None)
+    return stamps
+
+
+def save_snapshot(path=CONTENT_SNAPSHOT_PATH, paths=CONTENT_FILES, phases=MOON_PHASE_NAMES):
+    """Valida y compila los JSON y guarda el resultado con marshal.
+
+    Junto al contenido se guardan mtime y tamaño de cada fuente: si alguna
+    cambia después, el snapshot se considera desactualizado.
+    """
+    stamps = _stat(paths)
+    data = [_read_json(p) for p in paths]
+    _validate(*data, phases)
+    payload = {
+        "format": SNAPSHOT_FORMAT,
+        "python": sys.implementation.cache_tag,
+        "sources": stamps,
+        "phases": list(phases),
+        "compiled": _compile(*data, phases),
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        marshal.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, paths=CONTENT_FILES, phases=(), version=0):
+    """Índice del snapshot, o None si no existe, no es legible o está desactualizado."""
+    try:
+        with open(path, "rb") as f:
+            # marshal.load sobre el fichero hace una lectura por objeto; leerlo entero es varias veces más rápido.
+            payload = marshal.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        logger.warning(f"Snapshot de contenido no legible ({path}): {e}")
+        return None
+    if (not isinstance(payload, dict) or payload.get("format") != SNAPSHOT_FORMAT
+            or payload.get("python") != sys.implementation.cache_tag or payload.get("phases") != list(phases)):
+        logger.warning(f"Snapshot de contenido de otra versión ({path}), se usan los JSON")
+        return None
+    if payload["sources"] != _stat(paths):
+        logger.warning(f"Snapshot de contenido desactualizado ({path}), se usan los JSON. "
+                       f"Regenéralo con: python content.py")
+        return None
+    return ContentIndex.from_compiled(payload["compiled"], version)
+
+
+class ContentManager:
+    """Mantiene el índice vigente y lo recompila cuando cambian los ficheros.
+
+    La recompilación se hace en un hilo y el índice nuevo sustituye al
+    anterior con una sola asignación: los handlers que ya tenían una
+    referencia al índice viejo terminan con él, y nunca ven un estado a
+    medio cargar. Si el contenido nuevo no es válido se mantiene el anterior.
+    """
+
+    def __init__(self, paths=CONTENT_FILES, phases=(), poll_interval=POLL_INTERVAL, snapshot_path=None):
+        self.paths = tuple(paths)
+        self.phases = tuple(phases)
+        self.poll_interval = poll_interval
+        self.on_reload = []
+        self._stamps = _stat(self.paths)
+        index = load_snapshot(snapshot_path, self.paths, self.phases) if snapshot_path else None
+        self.index = index or load_content(self.paths, self.phases)
+
+    async def reload(self):
+        stamps = _stat(self.paths)
+        loop = asyncio.get_running_loop()
+        try:
+            index = await loop.run_in_executor(
+                None, load_content, self.paths, self.phases, self.index.version + 1, True
+            )
+        except (OSError, ValueError) as e:
+            # json.JSONDecodeError y ContentError son ValueError.
+            logger.error(f"Contenido no recargado, se mantiene la versión {self.index.version}: {e}")
+            self._stamps = stamps
+            return False
+        self._stamps = stamps
+        self.index = index
+        for callback in self.on_reload:
+            callback(index)
+        logger.info(f"Contenido recargado (versión {index.version})")
+        return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if _stat(self.paths) != self._stamps:
+                await self.reload()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    path = os.getenv('CONTENT_SNAPSHOT_PATH', CONTENT_SNAPSHOT_PATH)
+    save_snapshot(path)
+    print(f"Snapshot de contenido guardado en {path} ({os.path.getsize(path) / 1024:.1f} KiB)")
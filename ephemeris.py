@@ -0,0 +1,283 @@
+import os
+import sys
+import mmap
+import math
+import struct
+import logging
+import threading
+import subprocess
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+EPHEMERIS_PATH = "moon_ephemeris.bin"
+EPHEMERIS_YEARS = 5
+HOUR = 3600
+J1970 = 2440587.5
+
+# Cabecera: magic, versión, primera hora (horas Unix), número de horas. 24 bytes
+# para que los arrays float32 que siguen queden alineados.
+_HEADER = struct.Struct("<4sIqI4x")
+_MAGIC = b"LEPH"
+_VERSION = 1
+
+MoonSnapshot = namedtuple("MoonSnapshot", "phase_fraction phase_index illumination distance_km")
+
+# Términos principales de la distancia lunar (Meeus, cap. 47): coeficientes de
+# D, M, M', F, coeficiente en metros.
+_DISTANCE_TERMS = (
+    (0, 0, 1, 0, -20905355), (2, 0, -1, 0, -3699111), (2, 0, 0, 0, -2955968),
+    (0, 0, 2, 0, -569925), (0, 1, 0, 0, 48888), (0, 0, 0, 2, -3149),
+    (2, 0, -2, 0, 246158), (2, -1, -1, 0, -152138), (2, 0, 1, 0, -170733),
+    (2, -1, 0, 0, -204586), (0, 1, -1, 0, -129620), (1, 0, 0, 0, 108743),
+    (0, 1, 1, 0, 104755), (2, 0, 0, -2, 10321), (0, 0, 1, -2, 79661),
+    (4, 0, -1, 0, -34782), (0, 0, 3, 0, -23210), (4, 0, -2, 0, -21636),
+    (2, 1, -1, 0, 24208), (2, 1, 0, 0, 30824), (1, 0, -1, 0, -8379),
+    (1, 1, 0, 0, -16675), (2, -1, 1, 0, -12831), (2, 0, 2, 0, -10445),
+    (4, 0, 0, 0, -11650), (2, 0, -3, 0, 14403), (0, 1, -2, 0, -7003),
+    (2, -1, -2, 0, 10056), (1, 0, 1, 0, 6322), (2, -2, 0, 0, -9884),
+    (0, 1, 2, 0, 5751), (2, -2, -1, 0, -4950), (2, 0, 1, -2, 4130),
+    (4, -1, -1, 0, -3958), (3, 0, -1, 0, 3258), (2, 1, 1, 0, 2616),
+    (4, -1, -2, 0, -1897), (0, 2, -1, 0, -2117), (2, 2, -1, 0, 2354),
+    (4, 0, 1, 0, -1423), (0, 0, 4, 0, -1117), (4, -1, 0, 0, -1571),
+    (1, 0, -2, 0, -1739), (0, 0, 2, -2, -4421), (0, 2, 1, 0, 1165),
+    (2, 0, -1, -2, 8752),
+)
+
+
+def phase_index(fraction):
+    """Índice en MOON_PHASE_NAMES para una fracción de ciclo (0 = nueva, 0.5 = llena)."""
+    if fraction < 0.0625 or fraction >= 0.9375:
+        return 0
+    if fraction < 0.3125:
+        return 1
+    if fraction < 0.6875:
+        return 2
+    return 3
+
+
+def compute_moon(jd):
+    """Calcula (fracción de fase, iluminación %, distancia km) para un día juliano."""
+    t = (jd - 2451545.0) / 36525
+    t2, t3 = t * t, t * t * t
+    d = math.radians((297.8501921 + 445267.1114034 * t - 0.0018819 * t2 + t3 / 545868) % 360)
+    m = math.radians((357.5291092 + 35999.0502909 * t - 0.0001536 * t2 + t3 / 24490000) % 360)
+    m1 = math.radians((134.9633964 + 477198.8675055 * t + 0.0087414 * t2 + t3 / 69699) % 360)
+    f = math.radians((93.2720950 + 483202.0175233 * t - 0.0036539 * t2 - t3 / 3526000) % 360)
+    e = 1 - 0.002516 * t - 0.0000074 * t2
+
+    # Elongación corregida (Meeus, cap. 48) y fracción iluminada.
+    elong = (math.degrees(d) + 6.289 * math.sin(m1) - 2.100 * math.sin(m)
+             + 1.274 * math.sin(2 * d - m1) + 0.658 * math.sin(2 * d)
+             + 0.214 * math.sin(2 * m1) + 0.110 * math.sin(d)) % 360
+    illumination = (1 - math.cos(math.radians(elong))) / 2 * 100
+
+    sigma_r = 0.0
+    for cd, cm, cm1, cf, coef in _DISTANCE_TERMS:
+        term = coef * math.cos(cd * d + cm * m + cm1 * m1 + cf * f)
+        if cm:
+            term *= e if abs(cm) == 1 else e * e
+        sigma_r += term
+    distance = 385000.56 + sigma_r / 1000
+    return elong / 360, illumination, distance
+
+
+def direct_snapshot(ts):
+    fraction, illum, dist = compute_moon(J1970 + ts / 86400)
+    return MoonSnapshot(fraction, phase_index(fraction), illum, dist)
+
+
+class Ephemeris:
+    """Tabla horaria precalculada de fase, iluminación y distancia lunar.
+
+    Los datos viven en arrays contiguos (float32/uint8), ~13 bytes por hora,
+    y pueden mapearse en memoria desde disco; `snapshot` es una indexación
+    directa por hora Unix.
+    """
+
+    def __init__(self, start_hour, count, phase, illumination, distance, index, mm=None):
+        self.start_hour = start_hour
+        self.count = count
+        self._phase = phase
+        self._illumination = illumination
+        self._distance = distance
+        self._index = index
+        self._mm = mm
+
+    @classmethod
+    def build(cls, start, end):
+        start_hour = int(start.timestamp()) // HOUR
+        count = int(end.timestamp()) // HOUR - start_hour + 1
+        phase = array("f", bytes(4 * count))
+        illumination = array("f", bytes(4 * count))
+        distance = array("f", bytes(4 * count))
+        index = array("B", bytes(count))
+        for i in range(count):
+            jd = J1970 + (start_hour + i) / 24
+            fraction, illum, dist = compute_moon(jd)
+            phase[i] = fraction
+            illumination[i] = illum
+            distance[i] = dist
+            index[i] = phase_index(fraction)
+        return cls(start_hour, count, phase, illumination, distance, index)
+
+    def save(self, path):
+        # Un nombre temporal por proceso: varios workers pueden generar la tabla a la vez.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, self.start_hour, self.count))
+            for column in (self._phase, self._illumination, self._distance, self._index):
+                f.write(column.tobytes() if isinstance(column, array) else bytes(column))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, start_hour, count = _HEADER.unpack_from(mm)
+        if magic != _MAGIC or version != _VERSION or len(mm) != _HEADER.size + 13 * count:
+            mm.close()
+            raise ValueError(f"Tabla de efemérides no válida: {path}")
+        view = memoryview(mm)
+        offset = _HEADER.size
+        columns = []
+        for _ in range(3):
+            columns.append(view[offset:offset + 4 * count].cast("f"))
+            offset += 4 * count
+        columns.append(view[offset:offset + count])
+        return cls(start_hour, count, *columns, mm=mm)
+
+    def covers(self, when):
+        i = int(when.timestamp()) // HOUR - self.start_hour
+        return 0 <= i < self.count
+
+    def snapshot(self, when=None):
+        if when is None:
+            when = datetime.now(timezone.utc)
+        i = int(when.timestamp()) // HOUR - self.start_hour
+        if 0 <= i < self.count:
+            return MoonSnapshot(self._phase[i], self._index[i], self._illumination[i], self._distance[i])
+        return direct_snapshot(when.timestamp())
+
+    def next_phase_change(self, ts):
+        """Timestamp de la primera hora a partir de `ts` con un índice de fase distinto."""
+        i = int(ts) // HOUR - self.start_hour
+        if not 0 <= i < self.count:
+            return (int(ts) // HOUR + 1) * HOUR
+        current = self._index[i]
+        j = i + 1
+        while j < self.count and self._index[j] == current:
+            j += 1
+        return (self.start_hour + j) * HOUR
+
+    @property
+    def nbytes(self):
+        return 13 * self.count
+
+
+class DirectEphemeris:
+    """Misma interfaz que Ephemeris pero calculando cada consulta.
+
+    Se usa mientras la tabla se genera en segundo plano: los resultados son
+    idénticos (mismas horas, mismas fórmulas), solo más lentos.
+    """
+
+    count = 0
+    nbytes = 0
+
+    def covers(self, when):
+        return False
+
+    def snapshot(self, when=None):
+        if when is None:
+            when = datetime.now(timezone.utc)
+        return direct_snapshot(when.timestamp())
+
+    def next_phase_change(self, ts):
+        hour = int(ts) // HOUR
+        current = phase_index(compute_moon(J1970 + hour / 24)[0])
+        # Ninguna fase dura más de una lunación (~29.5 días).
+        for h in range(hour + 1, hour + 24 * 30):
+            if phase_index(compute_moon(J1970 + h / 24)[0]) != current:
+                return h * HOUR
+        return (hour + 1) * HOUR
+
+
+def load_table(path=EPHEMERIS_PATH):
+    """Carga la tabla de disco si existe y cubre ±1 año desde hoy; si no, None."""
+    now = datetime.now(timezone.utc)
+    if sys.byteorder == "little" and os.path.exists(path):
+        try:
+            table = Ephemeris.load(path)
+            if table.covers(now - timedelta(days=365)) and table.covers(now + timedelta(days=365)):
+                return table
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo cargar {path}: {e}")
+    return None
+
+
+def load_or_build(path=EPHEMERIS_PATH, years=EPHEMERIS_YEARS):
+    """Carga la tabla de disco o la regenera si no existe o no cubre ±1 año desde hoy."""
+    table = load_table(path)
+    if table is not None:
+        return table
+    now = datetime.now(timezone.utc)
+    span = timedelta(days=round(365.25 * years))
+    start, end = now - span, now + span
+    logger.info(f"Generando tabla de efemérides {start:%Y-%m-%d} → {end:%Y-%m-%d}")
+    table = Ephemeris.build(start, end)
+    if sys.byteorder == "little":
+        try:
+            table.save(path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar {path}: {e}")
+    return table
+
+
+def _build_in_background(path):
+    # La generación tarda ~2 s de CPU en Python puro: en otro proceso no compite
+    # por el GIL con el bot, que mientras tanto responde con DirectEphemeris.
+    def build():
+        global _ephemeris
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--background"],
+                                env=dict(os.environ, EPHEMERIS_PATH=path), stdout=subprocess.DEVNULL)
+        table = load_table(path) if result.returncode == 0 else None
+        if table is None:
+            logger.warning("No se pudo generar la tabla de efemérides; se sigue calculando cada consulta")
+            return
+        _ephemeris = table
+        logger.info(f"Tabla de efemérides lista ({table.count} horas)")
+
+    threading.Thread(target=build, name="ephemeris-build", daemon=True).start()
+    return DirectEphemeris()
+
+
+_ephemeris = None
+
+
+def get_ephemeris():
+    """Tabla de efemérides compartida.
+
+    Si no hay tabla válida en disco no bloquea el arranque: devuelve un
+    DirectEphemeris y la genera en segundo plano; las llamadas posteriores
+    reciben la tabla en cuanto está lista.
+    """
+    global _ephemeris
+    if _ephemeris is None:
+        path = os.getenv('EPHEMERIS_PATH', EPHEMERIS_PATH)
+        _ephemeris = load_table(path)
+        if _ephemeris is None:
+            # En big-endian la tabla no se guarda en disco: se genera aquí como antes.
+            _ephemeris = _build_in_background(path) if sys.byteorder == "little" else load_or_build(path)
+    return _ephemeris
+
+
+if __name__ == "__main__":
+    if "--background" in sys.argv[1:] and hasattr(os, "nice"):
+        # Lanzado por el bot: con una sola CPU, que no le quite tiempo a los handlers.
+        os.nice(19)
+    logging.basicConfig(level=logging.INFO)
+    table = load_or_build(os.getenv('EPHEMERIS_PATH', EPHEMERIS_PATH))
+    print(f"{table.count} horas, {table.nbytes / 1e6:.1f} MB: {table.snapshot()}")
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+# Segundos que una conexión keep-alive puede esperar sin empezar una petición.
+IDLE_TIMEOUT = 60
+# Segundos para recibir el resto de una petición (o una respuesta) una vez empezada.
+READ_TIMEOUT = 10
+
+Request = namedtuple("Request", "method path headers body")
+Response = namedtuple("Response", "status body headers", defaults=(b"", None))
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+def _content_length(headers):
+    """Content-Length como entero; None si no es un número válido."""
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        return None
+    return length if length >= 0 else None
+
+
+async def _read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+class HTTPServer:
+    """Servidor HTTP/1.1 mínimo sobre asyncio, sin dependencias externas.
+
+    Pensado para tráfico local o de Telegram (cuerpos JSON pequeños): soporta
+    keep-alive y Content-Length, no chunked ni TLS (se pone detrás de un proxy).
+    `handler(request)` es una corrutina que devuelve un `Response`. Las
+    conexiones inactivas más de IDLE_TIMEOUT se cierran, y una petición que
+    no llega entera en READ_TIMEOUT recibe un 408.
+    """
+
+    def __init__(self, handler, host="127.0.0.1", port=0):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self._server = None
+        self._connections = {}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        tasks = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        # Al cerrar el transporte las lecturas pendientes ven EOF: se espera a
+        # que cada conexión termine en vez de dejarla cancelada al cerrar el loop.
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _serve(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                if isinstance(request, Response):
+                    await self._write(writer, request, keep_alive=False)
+                    break
+                try:
+                    response = await self.handler(request)
+                except Exception as e:
+                    logger.error(f"Error atendiendo {request.method} {request.path}: {e}")
+                    response = Response(500)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await self._write(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ValueError):
+            # ValueError: readline con una línea más larga que el límite del StreamReader.
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        # Si no llega nada, la conexión se cierra sin respuesta (TimeoutError en _serve).
+        request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+        if not request_line:
+            return None
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3:
+            return Response(400)
+        try:
+            headers = await asyncio.wait_for(_read_headers(reader), READ_TIMEOUT)
+            length = _content_length(headers)
+            if length is None:
+                return Response(400)
+            if length > MAX_BODY_SIZE:
+                return Response(413)
+            body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) if length else b""
+        except asyncio.TimeoutError:
+            return Response(408)
+        return Request(parts[0], parts[1], headers, body)
+
+    @staticmethod
+    async def _write(writer, response, keep_alive):
+        headers = {"Content-Length": str(len(response.body)), "Connection": "keep-alive" if keep_alive else "close"}
+        headers.update(response.headers or {})
+        head = f"HTTP/1.1 {response.status} {_REASONS.get(response.status, '')}\r\n"
+        head += "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + response.body)
+        await writer.drain()
+
+
+class HTTPConnectionPool:
+    """Cliente HTTP/1.1 mínimo con conexiones keep-alive a un único destino.
+
+    Para peticiones pequeñas entre procesos locales (runner.py reenvía
+    updates a los workers): mucho más barato por petición que httpx. Las
+    respuestas deben llevar Content-Length, como las de HTTPServer.
+    """
+
+    def __init__(self, host, port, size=8):
+        self.host = host
+        self.port = port
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def request(self, method, path, body=b"", headers=None):
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        head += "".join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+        data = head.encode("latin-1") + b"\r\n" + body
+        async with self._slots:
+            while self._idle:
+                # Una conexión reutilizada puede haberla cerrado el servidor: se prueba con otra.
+                try:
+                    return await self._send(*self._idle.pop(), data)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    continue
+            return await self._send(*await asyncio.open_connection(self.host, self.port), data)
+
+    async def _send(self, reader, writer, data):
+        try:
+            writer.write(data)
+            response, keep_alive = await asyncio.wait_for(self._read_response(reader), READ_TIMEOUT)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("conexión cerrada por el servidor")
+        parts = status_line.split()
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise ConnectionError(f"respuesta no válida: {status_line[:80]!r}")
+        status = int(parts[1])
+        headers = await _read_headers(reader)
+        length = _content_length(headers)
+        if length is None:
+            raise ConnectionError(f"Content-Length no válido: {headers.get('content-length')!r}")
+        body = await reader.readexactly(length) if length else b""
+        return Response(status, body, headers), headers.get("connection", "").lower() != "close"
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
@@ -1,39 +1,59 @@
 import os
 import json
-import math
-import random
 import locale
 import logging
 import sys
-from datetime import datetime
+import time
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfoNotFoundError
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup, BotCommand
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, ConversationHandler, ContextTypes, filters
+    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, ContextTypes, filters
 )
-from astral import LocationInfo
-from astral.moon import moonrise, phase
+from telegram.helpers import escape_markdown
+from ephemeris import get_ephemeris
+from content import ContentManager, ContentError, MOON_PHASE_NAMES, CONTENT_SNAPSHOT_PATH
+from moon_cache import BoundaryCache, prerender_loop
+from broadcast import SubscriberStore, Broadcaster, DEFAULT_DB_PATH as BROADCAST_DB_PATH
+from webhook import WebhookServer, ChatOrderedUpdateProcessor, DEFAULT_PORT as DEFAULT_WEBHOOK_PORT, DEFAULT_CONCURRENCY, DEFAULT_QUEUE_SIZE
+from notes_store import open_note_store, migrate_json_notes, EXPORT_FORMATS
+from moon_times import MoonTimes, load_cities, MOON_TIMES_PATH
+from persistence import SQLitePersistence, DEFAULT_DB_PATH as PERSISTENCE_DB_PATH
+from metrics import Metrics, MetricsServer, TimedRequest, JsonFormatter, instrument
 
-# Configurar logging
+load_dotenv()
+
+# Configurar logging (LOG_FORMAT=json para una línea JSON por registro)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+log_handler = logging.StreamHandler()
+if LOG_FORMAT == 'json':
+    log_handler.setFormatter(JsonFormatter())
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=logging.INFO,
+    handlers=[log_handler]
 )
 logger = logging.getLogger(__name__)
 
 # Cargar token
-load_dotenv()
 TOKEN = os.getenv('TELEGRAM_TOKEN')
 
-if not TOKEN:
-    logger.error("No se encontró el token de Telegram. Asegúrate de tener config.env con TELEGRAM_TOKEN")
-    sys.exit(1)
-
-MOON_CYCLE_DAYS = 30
-NEW_MOON_THRESHOLD = 7
-FIRST_QUARTER_THRESHOLD = 15
-FULL_MOON_THRESHOLD = 22
-MOON_PHASE_NAMES = ["Luna Nueva", "Cuarto Creciente", "Luna Llena", "Cuarto Menguante"]
+# Con logs JSON cada update deja además una línea con su duración y tiempos de E/S.
+METRICS = Metrics(log_timings=LOG_FORMAT == 'json')
+SNAPSHOT_TIMER = METRICS.timer("astronomy", "snapshot")
+PHASE_CHANGE_TIMER = METRICS.timer("astronomy", "next_phase_change")
+MOON_TIMES_TIMER = METRICS.timer("astronomy", "moon_times")
+RENDER_TIMER = METRICS.timer("content", "render_luna")
+LOOKUP_TIMER = METRICS.timer("content", "lookup")
+ADD_NOTE_TIMER = METRICS.timer("storage", "add_note")
+RECENT_NOTES_TIMER = METRICS.timer("storage", "recent_notes")
+SEARCH_NOTES_TIMER = METRICS.timer("storage", "search_notes")
+NOTE_STATS_TIMER = METRICS.timer("storage", "note_stats")
+EXPORT_NOTES_TIMER = METRICS.timer("storage", "export_notes")
+SUBSCRIBERS_TIMER = METRICS.timer("storage", "subscribers")
 
 try:
     locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
@@ -41,74 +61,34 @@ except locale.Error:
     pass
 
 try:
-    with open("moon_data.json", encoding="utf-8") as f:
-        MOON_DATA = json.load(f)
-    with open("moon_science_data.json", encoding="utf-8") as f:
-        MOON_SCIENCE_DATA = json.load(f)
-    with open("rituals_db.json", encoding="utf-8") as f:
-        RITUALS_DATA = json.load(f)
+    # Con un snapshot al día (python content.py) se evita parsear y validar los JSON.
+    CONTENT = ContentManager(phases=MOON_PHASE_NAMES,
+                             snapshot_path=os.getenv('CONTENT_SNAPSHOT_PATH', CONTENT_SNAPSHOT_PATH))
 except FileNotFoundError as e:
     logger.error(f"Archivo JSON no encontrado: {e}")
     sys.exit(1)
 except json.JSONDecodeError as e:
     logger.error(f"Error al decodificar JSON: {e}")
     sys.exit(1)
+except ContentError as e:
+    logger.error(f"Contenido JSON no válido:\n{e}")
+    sys.exit(1)
 
 NOTE = 1
 ADMIN_USERNAMES = ["divae", "EstelaYoMisma"]
 CHANNEL_CHAT_ID = '@lun_ia_oficial'
+# Segundos que se esperan al detener el bot para que terminen los envíos en vuelo del envío diario.
+BROADCAST_STOP_TIMEOUT = 10
+
+def get_moon_snapshot(when=None):
+    with SNAPSHOT_TIMER.time():
+        return get_ephemeris().snapshot(when)
 
 def get_moon_phase():
-    try:
-        moon_phase_value = phase(datetime.now())
-        if moon_phase_value < 0.0625:
-            return 0
-        elif moon_phase_value < 0.1875:
-            return 1
-        elif moon_phase_value < 0.3125:
-            return 1
-        elif moon_phase_value < 0.4375:
-            return 2
-        elif moon_phase_value < 0.5625:
-            return 2
-        elif moon_phase_value < 0.6875:
-            return 2
-        elif moon_phase_value < 0.8125:
-            return 3
-        elif moon_phase_value < 0.9375:
-            return 3
-        else:
-            return 0
-    except Exception as e:
-        logger.error(f"Error calculando fase lunar: {e}")
-        now = datetime.now()
-        r = (now.year % 100) % 19
-        if r > 9:
-            r -= 19
-        phase_calc = ((r * 11) % MOON_CYCLE_DAYS) + now.month + now.day
-        if now.month < 3:
-            phase_calc += 2
-        phase_calc -= 8.3
-        phase_calc = int(phase_calc + 0.5) % MOON_CYCLE_DAYS
-        if phase_calc < NEW_MOON_THRESHOLD:
-            return 0
-        if phase_calc < FIRST_QUARTER_THRESHOLD:
-            return 1
-        if phase_calc < FULL_MOON_THRESHOLD:
-            return 2
-        return 3
-
-def get_moon_illumination():
-    moon_phase_value = phase(datetime.now())
-    return round(abs(math.sin(moon_phase_value * math.pi)) * 100, 1)
-
-def get_moon_distance():
-    day_of_year = datetime.now().timetuple().tm_yday
-    variation = 25000 * math.sin(2 * math.pi * day_of_year / 365.25)
-    return round(384400 + variation, -3)
-
-def get_zodiac_sign():
-    now = datetime.now()
+    return get_moon_snapshot().phase_index
+
+def get_zodiac_sign(now=None):
+    now = now or datetime.now()
     month, day = now.month, now.day
     zodiac_signs = [
         ("Capricornio", 1, 19), ("Acuario", 1, 20), ("Piscis", 2, 19),
@@ -133,40 +113,103 @@ async def intro(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Aquí puedes recibir inspiración lunar diaria, rituales, mantras, meditaciones y tips.\n"
         "Comandos:\n"
         "/luna – Mensaje lunar\n"
+        "/ubicacion [ciudad] – Salida y puesta de la luna en tu zona\n"
         "/anotar – Registrar avance\n"
         "/logros – Ver notas\n"
+        "/buscar [texto] – Buscar en tus notas\n"
+        "/patrones – Tus notas por fase y por mes\n"
+        "/exportar [csv|json] – Descargar todas tus notas\n"
         "/meditacion [tema]\n"
         "/mantra [tema]\n"
         "/conjuro [tema]\n"
+        "/suscribir – Recibir el mensaje lunar cada día\n"
+        "/desuscribir – Dejar de recibirlo\n"
         "/contacto – Info y contacto"
     )
     await update.message.reply_text(msg)
 
+def moon_message_key(ts):
+    now = datetime.fromtimestamp(ts)
+    return (now.date(), get_moon_snapshot(now).phase_index, get_zodiac_sign(now), locale.getlocale(locale.LC_TIME))
+
+def moon_message_boundary(ts):
+    # El mensaje cambia a medianoche (fecha y signo) o cuando cambia la fase.
+    now = datetime.fromtimestamp(ts)
+    next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time()).timestamp()
+    with PHASE_CHANGE_TIMER.time():
+        return min(next_midnight, get_ephemeris().next_phase_change(ts))
+
+def render_moon_message(ts):
+    with RENDER_TIMER.time():
+        return _render_moon_message(ts)
+
+def _render_moon_message(ts):
+    now = datetime.fromtimestamp(ts)
+    snapshot = get_moon_snapshot(now)
+    phase_name = MOON_PHASE_NAMES[snapshot.phase_index]
+    science_data = CONTENT.index.science[phase_name]
+    illumination = round(snapshot.illumination, 1)
+    distance = int(round(snapshot.distance_km, -3))
+    zodiac = get_zodiac_sign(now)
+    date_str = now.strftime('%-d %B %Y')
+
+    phase_emoji = {"Luna Nueva": "🌑", "Cuarto Creciente": "🌔", "Luna Llena": "🌕", "Cuarto Menguante": "🌗"}
+
+    return (
+        f"{phase_emoji[phase_name]} {phase_name} en {zodiac} – {date_str} {phase_emoji[phase_name]}\n\n"
+        f"✨ Iluminación: {illumination}%\n"
+        f"🌍 Distancia Tierra-Luna: ~{distance:,} km\n\n"
+        f"👉 Dato curioso:\n"
+        f"{science_data['curiosidad']}\n\n"
+        f"✨ Ritual breve para hoy:\n"
+        f"{science_data['ritual_breve']}\n\n"
+        f"Es momento de:\n"
+        f"{science_data['momentos_propicios']}\n\n"
+        f"¿Quieres inspiración personalizada, mantras, meditaciones o anotar tus logros?\n"
+        f"Habla conmigo en privado: @lun_ia_my_bot"
+    )
+
+def format_local_time(ts, tz):
+    return datetime.fromtimestamp(ts, tz).strftime('%H:%M')
+
+def local_moon_section(moon_times, location, ts=None):
+    """Salida y puesta de la luna de hoy y fase actual, en la hora local de la ubicación guardada."""
+    ts = time.time() if ts is None else ts
+    city = moon_times.cities.get(location.get("city"))
+    if city is not None:
+        place, tz_name = city.name, city.tz
+    elif "lat" in location:
+        place, tz_name = f"{location['lat']:.2f}, {location['lon']:.2f}", location["tz"]
+    else:
+        # Ciudad que ya no está en cities.json.
+        return None
+    tz = moon_times.zone(tz_name)
+    day = datetime.fromtimestamp(ts, tz).date()
+    with MOON_TIMES_TIMER.time():
+        if city is not None:
+            times = moon_times.for_city(city, day)
+        else:
+            times = moon_times.for_coordinates(location["lat"], location["lon"], tz_name, day)
+    phase_name = MOON_PHASE_NAMES[get_moon_snapshot(datetime.fromtimestamp(ts)).phase_index]
+    with PHASE_CHANGE_TIMER.time():
+        phase_change = datetime.fromtimestamp(get_ephemeris().next_phase_change(ts), tz)
+    rise = format_local_time(times.rise, tz) if times.rise is not None else "hoy no sale"
+    moonset = format_local_time(times.set, tz) if times.set is not None else "hoy no se pone"
+    return (
+        f"📍 {place} ({tz_name})\n"
+        f"🌙 Salida: {rise} · Puesta: {moonset}\n"
+        f"{phase_name} hasta el {phase_change:%d/%m} a las {phase_change:%H:%M}"
+    )
+
 async def moon(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        idx = get_moon_phase()
-        phase_name = MOON_PHASE_NAMES[idx]
-        science_data = MOON_SCIENCE_DATA[phase_name]
-        illumination = get_moon_illumination()
-        distance = get_moon_distance()
-        zodiac = get_zodiac_sign()
-        date_str = datetime.now().strftime('%-d %B %Y')
-
-        phase_emoji = {"Luna Nueva": "🌑", "Cuarto Creciente": "🌔", "Luna Llena": "🌕", "Cuarto Menguante": "🌗"}
-
-        message = (
-            f"{phase_emoji[phase_name]} {phase_name} en {zodiac} – {date_str} {phase_emoji[phase_name]}\n\n"
-            f"✨ Iluminación: {illumination}%\n"
-            f"🌍 Distancia Tierra-Luna: ~{distance:,} km\n\n"
-            f"👉 Dato curioso:\n"
-            f"{science_data['curiosidad']}\n\n"
-            f"✨ Ritual breve para hoy:\n"
-            f"{science_data['ritual_breve']}\n\n"
-            f"Es momento de:\n"
-            f"{science_data['momentos_propicios']}\n\n"
-            f"¿Quieres inspiración personalizada, mantras, meditaciones o anotar tus logros?\n"
-            f"Habla conmigo en privado: @lun_ia_my_bot"
-        )
+        message = context.bot_data["moon_cache"].get()
+        # El mensaje general está cacheado; la parte local se añade por usuario.
+        location = (context.user_data or {}).get("location")
+        if location:
+            section = local_moon_section(context.bot_data["moon_times"], location)
+            if section:
+                message = f"{message}\n\n{section}"
         await update.message.reply_text(message)
     except Exception as e:
         logger.error(f"Error en función moon: {e}")
@@ -175,6 +218,62 @@ async def moon(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             logger.error("No se pudo enviar mensaje de error al usuario")
 
+def parse_location(moon_times, text):
+    """Ubicación a guardar a partir de `ciudad` o `lat lon [zona horaria]`; None si no se entiende."""
+    parts = text.replace(",", " ").split()
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except (IndexError, ValueError):
+        city = moon_times.find_city(text)
+        return {"city": city.key} if city else None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or len(parts) > 3:
+        return None
+    if len(parts) == 3:
+        try:
+            moon_times.zone(parts[2])
+        except (ZoneInfoNotFoundError, ValueError):
+            return None
+        tz_name = parts[2]
+    else:
+        tz_name = moon_times.zone_for(lat, lon)
+    return {"lat": lat, "lon": lon, "tz": tz_name}
+
+async def reply_location(update, context, location):
+    context.user_data["location"] = location
+    section = local_moon_section(context.bot_data["moon_times"], location)
+    await update.message.reply_text(f"✅ Ubicación guardada. Usa /luna para ver tu mensaje lunar.\n\n{section}")
+
+async def ubicacion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    moon_times = context.bot_data["moon_times"]
+    usage = (
+        "Uso:\n"
+        "/ubicacion Madrid – una ciudad\n"
+        "/ubicacion 40.42 -3.70 – coordenadas (opcional: zona horaria, p. ej. Europe/Madrid)\n"
+        "/ubicacion borrar – olvidar tu ubicación\n"
+        "También puedes enviarme tu ubicación desde el clip 📎."
+    )
+    if not context.args:
+        location = context.user_data.get("location")
+        section = local_moon_section(moon_times, location) if location else None
+        current = f"Tu ubicación:\n{section}" if section else "Aún no tienes ubicación guardada."
+        await update.message.reply_text(f"{current}\n\n{usage}")
+        return
+    if context.args == ["borrar"]:
+        context.user_data.pop("location", None)
+        await update.message.reply_text("Ubicación borrada.")
+        return
+    location = parse_location(moon_times, " ".join(context.args))
+    if location is None:
+        await update.message.reply_text(f"No reconozco «{' '.join(context.args)}».\n\n{usage}")
+        return
+    await reply_location(update, context, location)
+
+async def shared_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    point = update.message.location
+    moon_times = context.bot_data["moon_times"]
+    await reply_location(update, context, {"lat": point.latitude, "lon": point.longitude,
+                                           "tz": moon_times.zone_for(point.latitude, point.longitude)})
+
 async def ask_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("¿Qué quieres anotar hoy? Escribe tu avance. Usa /cancelar para cancelar.")
     return NOTE
@@ -182,20 +281,13 @@ async def ask_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def save_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     note_text = update.message.text
-    phase_idx = get_moon_phase()
-    phase_name = MOON_PHASE_NAMES[phase_idx]
+    snapshot = get_moon_snapshot()
+    phase_name = MOON_PHASE_NAMES[snapshot.phase_index]
     now = datetime.now().strftime('%Y-%m-%d')
-    moon_phase_value = phase(datetime.now())
-    logger.info(f"Fase lunar calculada: {moon_phase_value:.3f} -> {phase_name} (índice: {phase_idx})")
+    logger.info(f"Fase lunar calculada: {snapshot.phase_fraction:.3f} -> {phase_name} (índice: {snapshot.phase_index})")
     note_entry = {"date": now, "phase": phase_name, "note": note_text}
-    try:
-        with open("user_notes.json", "r", encoding="utf-8") as f:
-            notes = json.load(f)
-    except:
-        notes = {}
-    notes.setdefault(user_id, []).append(note_entry)
-    with open("user_notes.json", "w", encoding="utf-8") as f:
-        json.dump(notes, f, ensure_ascii=False, indent=2)
+    with ADD_NOTE_TIMER.time():
+        await context.bot_data["notes"].add_note(user_id, note_entry)
     await update.message.reply_text(f"✅ Nota guardada en {phase_name}. Usa /logros para ver tu historial.")
     return ConversationHandler.END
 
@@ -203,107 +295,400 @@ async def cancel_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ Anotación cancelada.")
     return ConversationHandler.END
 
+def format_notes(notes):
+    return "".join(f"{n['date']} ({n['phase']}): {escape_markdown(n['note'])}\n\n" for n in notes)
+
+async def logros_page(notes, user_id, cursor=None):
+    """Texto y teclado de una página de /logros.
+
+    `cursor` viene del botón pulsado: `b<id>` para las notas anteriores a esa
+    id y `a<id>` para las posteriores. Devuelve (None, None) si no hay notas.
+    """
+    with RECENT_NOTES_TIMER.time():
+        if cursor and cursor[0] == "a":
+            page, newer = await notes.notes_page(user_id, after=int(cursor[1:]))
+            older = True
+            if not newer:
+                # Ya es la primera página: se muestra completa.
+                page, older = await notes.notes_page(user_id)
+        elif cursor:
+            page, older = await notes.notes_page(user_id, before=int(cursor[1:]))
+            newer = True
+        else:
+            page, older = await notes.notes_page(user_id)
+            newer = False
+    if not page:
+        return None, None
+    buttons = []
+    if newer:
+        buttons.append(InlineKeyboardButton("⬅️ Más recientes", callback_data=f"logros:{user_id}:a{page[0]['id']}"))
+    if older:
+        buttons.append(InlineKeyboardButton("Más antiguas ➡️", callback_data=f"logros:{user_id}:b{page[-1]['id']}"))
+    title = "📒 *Tus notas recientes:*" if not newer else "📒 *Tus notas:*"
+    return f"{title}\n\n{format_notes(page)}", InlineKeyboardMarkup([buttons]) if buttons else None
+
 async def show_logros(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    try:
-        with open("user_notes.json", "r", encoding="utf-8") as f:
-            notes = json.load(f)
-    except:
-        notes = {}
-    user_notes = notes.get(user_id, [])
-    if not user_notes:
+    text, keyboard = await logros_page(context.bot_data["notes"], user_id)
+    if text is None:
         await update.message.reply_text("Aún no tienes logros. Usa /anotar para registrar tu avance.")
         return
-    msg = "📒 *Tus notas recientes:*\n\n"
-    for n in user_notes[-10:][::-1]:
-        msg += f"{n['date']} ({n['phase']}): {n['note']}\n\n"
-    await update.message.reply_text(msg, parse_mode='Markdown')
+    await update.message.reply_text(text, parse_mode='Markdown', reply_markup=keyboard)
 
-async def get_mantra(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.args:
-        await update.message.reply_text("Uso: /mantra [tema]\nTemas disponibles: proyectos, amor, creatividad, abundancia, proteccion, limpieza")
+async def change_logros_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, owner, cursor = query.data.split(":")
+    # En un grupo cualquiera puede pulsar los botones: solo la dueña de las notas pasa de página.
+    if owner != str(query.from_user.id):
+        await query.answer("Estas notas no son tuyas. Usa /logros para ver las tuyas.")
         return
-    theme = context.args[0].lower()
-    phase_idx = get_moon_phase()
-    phase_name = MOON_PHASE_NAMES[phase_idx]
-    try:
-        mantras = RITUALS_DATA[phase_name]["mantras"]
-        if theme in mantras:
-            mantra = random.choice(mantras[theme])
-            message = f"🧘‍♀️ *Mantra para {theme} en {phase_name}:*\n\n{mantra}\n\n💫 Repítelo 3 veces al día para potenciar su efecto."
-            await update.message.reply_text(message, parse_mode='Markdown')
-        else:
-            available_themes = ", ".join(mantras.keys())
-            await update.message.reply_text(f"Tema '{theme}' no disponible para {phase_name}.\nTemas disponibles: {available_themes}")
-    except KeyError:
-        await update.message.reply_text(f"No hay mantras disponibles para {phase_name}.")
+    await query.answer()
+    text, keyboard = await logros_page(context.bot_data["notes"], owner, cursor)
+    if text is None:
+        await query.edit_message_text("Aún no tienes logros. Usa /anotar para registrar tu avance.")
+        return
+    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=keyboard)
 
-async def get_meditacion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def buscar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
-        await update.message.reply_text("Uso: /meditacion [tema]\nTemas disponibles: proyectos, amor, creatividad, abundancia, proteccion, limpieza")
+        await update.message.reply_text("Uso: /buscar texto — busca en tus notas (sin distinguir mayúsculas ni tildes).")
         return
-    theme = context.args[0].lower()
-    phase_idx = get_moon_phase()
-    phase_name = MOON_PHASE_NAMES[phase_idx]
-    try:
-        meditaciones = RITUALS_DATA[phase_name]["meditaciones"]
-        if theme in meditaciones:
-            meditacion = random.choice(meditaciones[theme])
-            message = f"🧘‍♀️ *Meditación para {theme} en {phase_name}:*\n\n{meditacion}\n\n✨ Dedica 5-10 minutos a esta práctica."
-            await update.message.reply_text(message, parse_mode='Markdown')
-        else:
-            available_themes = ", ".join(meditaciones.keys())
-            await update.message.reply_text(f"Tema '{theme}' no disponible para {phase_name}.\nTemas disponibles: {available_themes}")
-    except KeyError:
-        await update.message.reply_text(f"No hay meditaciones disponibles para {phase_name}.")
+    text = " ".join(context.args)
+    with SEARCH_NOTES_TIMER.time():
+        found = await context.bot_data["notes"].search_notes(update.effective_user.id, text)
+    if not found:
+        await update.message.reply_text(f"No hay notas con «{text}».")
+        return
+    msg = f"🔎 *Notas con «{escape_markdown(text)}»* (las {len(found)} más recientes):\n\n"
+    await update.message.reply_text(msg + format_notes(found), parse_mode='Markdown')
 
-async def get_conjuro(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def patrones(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with NOTE_STATS_TIMER.time():
+        stats = await context.bot_data["notes"].note_stats(update.effective_user.id)
+    phases, months = stats["phases"], stats["months"]
+    if not phases:
+        await update.message.reply_text("Aún no tienes notas. Usa /anotar para registrar tu avance.")
+        return
+    total = sum(phases.values())
+    # Primero las fases en su orden; después las de notas antiguas con otros nombres.
+    ordered = [p for p in MOON_PHASE_NAMES if p in phases] + sorted(p for p in phases if p not in MOON_PHASE_NAMES)
+    top = max(ordered, key=phases.get)
+    msg = f"📊 *Tus patrones lunares* ({total} notas)\n\n*Por fase:*\n"
+    for phase in ordered:
+        msg += f"{phase}: {phases[phase]} ({phases[phase] * 100 // total}%)\n"
+    msg += "\n*Por mes:*\n"
+    for month in sorted(months, reverse=True)[:12]:
+        msg += f"{month}: {months[month]}\n"
+    msg += f"\nTu fase más activa es {top}."
+    await update.message.reply_text(msg, parse_mode='Markdown')
+
+async def exportar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    fmt = context.args[0].lower() if context.args else "csv"
+    if fmt not in EXPORT_FORMATS:
+        await update.message.reply_text(f"Formatos disponibles: {', '.join(EXPORT_FORMATS)}. Ejemplo: /exportar json")
+        return
+    # Las notas se escriben por trozos a un fichero temporal, no a un string en memoria.
+    with tempfile.TemporaryFile() as f:
+        with EXPORT_NOTES_TIMER.time():
+            count = await context.bot_data["notes"].export_notes(update.effective_user.id, fmt, f)
+        if not count:
+            await update.message.reply_text("Aún no tienes notas. Usa /anotar para registrar tu avance.")
+            return
+        f.seek(0)
+        await update.message.reply_document(f, filename=f"lunia_notas.{fmt}", caption=f"📦 Tus {count} notas")
+
+async def reply_ritual(update: Update, context: ContextTypes.DEFAULT_TYPE, kind, template):
+    index = CONTENT.index
     if not context.args:
-        await update.message.reply_text("Uso: /conjuro [tema]\nTemas disponibles: proteccion, abundancia, amor, creatividad, limpieza")
+        await update.message.reply_text(index.help(kind))
         return
-    theme = context.args[0].lower()
-    phase_idx = get_moon_phase()
-    phase_name = MOON_PHASE_NAMES[phase_idx]
-    try:
-        conjuros = RITUALS_DATA[phase_name]["conjuros"]
-        if theme in conjuros:
-            conjuro = random.choice(conjuros[theme])
-            message = f"🔮 *Conjuro para {theme} en {phase_name}:*\n\n{conjuro}\n\n🌟 Realiza este ritual con intención y fe."
-            await update.message.reply_text(message, parse_mode='Markdown')
-        else:
-            available_themes = ", ".join(conjuros.keys())
-            await update.message.reply_text(f"Tema '{theme}' no disponible para {phase_name}.\nTemas disponibles: {available_themes}")
-    except KeyError:
-        await update.message.reply_text(f"No hay conjuros disponibles para {phase_name}.")
+    phase_name = MOON_PHASE_NAMES[get_moon_phase()]
+    with LOOKUP_TIMER.time():
+        found = index.choice(phase_name, kind, context.args[0])
+        available_themes = None if found else index.available(phase_name, kind)
+    if found:
+        theme, text = found
+        await update.message.reply_text(template.format(theme=theme, phase=phase_name, text=text), parse_mode='Markdown')
+        return
+    if available_themes:
+        await update.message.reply_text(f"Tema '{context.args[0].lower()}' no disponible para {phase_name}.\nTemas disponibles: {available_themes}")
+    else:
+        await update.message.reply_text(f"No hay {kind} disponibles para {phase_name}.")
+
+async def get_mantra(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await reply_ritual(update, context, "mantras",
+                       "🧘‍♀️ *Mantra para {theme} en {phase}:*\n\n{text}\n\n💫 Repítelo 3 veces al día para potenciar su efecto.")
+
+async def get_meditacion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await reply_ritual(update, context, "meditaciones",
+                       "🧘‍♀️ *Meditación para {theme} en {phase}:*\n\n{text}\n\n✨ Dedica 5-10 minutos a esta práctica.")
+
+async def get_conjuro(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await reply_ritual(update, context, "conjuros",
+                       "🔮 *Conjuro para {theme} en {phase}:*\n\n{text}\n\n🌟 Realiza este ritual con intención y fe.")
 
 async def contacto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Puedes contactarme en Telegram: @divae\nGracias por usar LUN.IA 🌙")
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Error en el bot: {context.error}")
+    METRICS.error(context.error)
     if update and hasattr(update, 'effective_message') and update.effective_message:
         await update.effective_message.reply_text("❌ Ocurrió un error. Por favor, intenta de nuevo más tarde.")
 
-async def main():
-    application = ApplicationBuilder().token(TOKEN).build()
+async def suscribir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = context.bot_data["subscribers"]
+    with SUBSCRIBERS_TIMER.time():
+        added = await store.run(store.add, update.effective_chat.id)
+    if added:
+        await update.message.reply_text("🌙 Te has suscrito. Recibirás el mensaje lunar cada día. Usa /desuscribir para darte de baja.")
+    else:
+        await update.message.reply_text("Ya estabas suscrit@. Usa /desuscribir para darte de baja.")
+
+async def desuscribir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = context.bot_data["subscribers"]
+    with SUBSCRIBERS_TIMER.time():
+        removed = await store.run(store.remove, update.effective_chat.id)
+    if removed:
+        await update.message.reply_text("Suscripción cancelada. Puedes volver cuando quieras con /suscribir.")
+    else:
+        await update.message.reply_text("No estabas suscrit@. Usa /suscribir para recibir el mensaje diario.")
+
+def start_broadcast(application, broadcaster, broadcast_id, send):
+    """Lanza `send()` como tarea del envío `broadcast_id`, salvo que ya haya una en curso.
+
+    No se ejecuta dentro del job: Application.stop() espera a los jobs en
+    marcha, y un envío a 100k suscriptores dura casi una hora. En on_stop se
+    detiene `broadcaster`, que guarda hasta dónde llegó.
+    """
+    broadcasts = application.bot_data["broadcasts"]
+    if broadcast_id in broadcasts:
+        # El envío diario y la reanudación del arranque pueden coincidir.
+        logger.info(f"Envío {broadcast_id} ya en curso")
+        return None
+    task = asyncio.create_task(send())
+    broadcasts[broadcast_id] = (broadcaster, task)
+
+    def done(task):
+        broadcasts.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Error en el envío {broadcast_id}: {task.exception()}")
+    task.add_done_callback(done)
+    return task
+
+async def daily_broadcast(context: ContextTypes.DEFAULT_TYPE):
+    text = context.bot_data["moon_cache"].get()
+    broadcaster = Broadcaster(context.bot, context.bot_data["subscribers"])
+    broadcast_id = datetime.now().strftime('%Y-%m-%d')
+    start_broadcast(context.application, broadcaster, broadcast_id,
+                    lambda: broadcaster.run(broadcast_id, text, channel=CHANNEL_CHAT_ID))
+
+async def resume_broadcasts(context: ContextTypes.DEFAULT_TYPE):
+    store = context.bot_data["subscribers"]
+    today = datetime.now().strftime('%Y-%m-%d')
+    for broadcast_id in await store.run(store.pending_broadcasts):
+        if broadcast_id != today:
+            # El mensaje lunar de otro día ya no sirve: se cierra sin enviar lo que faltaba.
+            logger.warning(f"Envío {broadcast_id} sin terminar de otro día, se descarta")
+            await store.run(store.close_broadcast, broadcast_id)
+            continue
+        logger.info(f"Reanudando envío {broadcast_id}")
+        broadcaster = Broadcaster(context.bot, store)
+        start_broadcast(context.application, broadcaster, broadcast_id,
+                        lambda: broadcaster.resume(broadcast_id, channel=CHANNEL_CHAT_ID))
+
+async def estado(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.username not in ADMIN_USERNAMES:
+        return
+    stats = context.bot_data["moon_cache"].stats()
+    await update.message.reply_text(
+        f"Caché /luna: {stats['hits']} aciertos, {stats['misses']} fallos, "
+        f"{stats['prerendered']} pre-renderizados, {stats['entries']} entradas"
+    )
+
+async def on_startup(application):
+    moon_cache = application.bot_data["moon_cache"]
+    CONTENT.on_reload.append(lambda index: moon_cache.clear())
+    application.bot_data["prerender_task"] = asyncio.create_task(prerender_loop(moon_cache))
+    application.bot_data["content_task"] = asyncio.create_task(CONTENT.watch())
+    application.bot_data["moon_times_task"] = asyncio.create_task(application.bot_data["moon_times"].refresh_loop())
+    metrics_port = int(os.getenv('METRICS_PORT', 0))
+    if metrics_port:
+        application.bot_data["metrics_server"] = await MetricsServer(METRICS, port=metrics_port).start()
+
+async def on_stop(application):
+    # Antes de cerrar el bot: los envíos en curso terminan lo que está en vuelo, guardan su
+    # progreso y el próximo arranque los reanuda. Si tardan demasiado, se cancelan.
+    broadcasts = list(application.bot_data["broadcasts"].values())
+    for broadcaster, _ in broadcasts:
+        broadcaster.stop()
+    tasks = [task for _, task in broadcasts]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=BROADCAST_STOP_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def on_shutdown(application):
+    application.bot_data["prerender_task"].cancel()
+    application.bot_data["content_task"].cancel()
+    application.bot_data["moon_times_task"].cancel()
+    application.bot_data["notes"].close()
+    application.bot_data["subscribers"].close()
+    if "metrics_server" in application.bot_data:
+        await application.bot_data.pop("metrics_server").stop()
+
+def build_application(mode="polling", concurrency=DEFAULT_CONCURRENCY, base_url=None, jobs=True):
+    """Construye la Application con todos los handlers.
+
+    Con `jobs=False` no se programan el envío diario ni su reanudación: al
+    repartir las updates entre varios procesos (runner.py) solo el primero
+    los ejecuta.
+    """
+    get_ephemeris()
+    notes = open_note_store()
+    migrate_json_notes(notes)
+    # Una conexión por update en curso más margen para el envío diario; un pool
+    # mucho mayor solo añade coste a httpx al buscar conexiones libres.
+    request = TimedRequest(METRICS, connection_pool_size=concurrency + 8)
+    # Updates en paralelo, salvo las de un mismo chat (ver ChatOrderedUpdateProcessor).
+    builder = ApplicationBuilder().token(TOKEN).concurrent_updates(ChatOrderedUpdateProcessor(concurrency)).request(request)
+    builder = builder.post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown)
+    # Estado de las conversaciones en disco: sobrevive a reinicios y lo comparten los workers.
+    builder = builder.persistence(SQLitePersistence(os.getenv('PERSISTENCE_PATH', PERSISTENCE_DB_PATH)))
+    if base_url:
+        builder = builder.base_url(base_url)
+    if mode == "webhook":
+        # En modo webhook las updates llegan por WebhookServer, no por el Updater.
+        builder = builder.updater(None)
+    application = builder.build()
+    application.bot_data["notes"] = notes
+    application.bot_data["moon_cache"] = BoundaryCache(moon_message_key, render_moon_message, moon_message_boundary)
+    application.bot_data["subscribers"] = SubscriberStore(os.getenv('BROADCAST_DB_PATH', BROADCAST_DB_PATH))
+    application.bot_data["broadcasts"] = {}
+    application.bot_data["moon_times"] = MoonTimes(*load_cities(), path=os.getenv('MOON_TIMES_PATH', MOON_TIMES_PATH))
+    if jobs:
+        broadcast_time = datetime.strptime(os.getenv('BROADCAST_TIME', '08:00'), '%H:%M').time()
+        application.job_queue.run_daily(daily_broadcast, broadcast_time.replace(tzinfo=datetime.now().astimezone().tzinfo))
+        application.job_queue.run_once(resume_broadcasts, 0)
     application.add_error_handler(error_handler)
     note_conv_handler = ConversationHandler(
         entry_points=[CommandHandler('anotar', ask_note)],
         states={NOTE: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_note)]},
-        fallbacks=[CommandHandler('cancelar', cancel_note)]
+        fallbacks=[CommandHandler('cancelar', cancel_note)],
+        name="anotar",
+        persistent=True
     )
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('intro', intro))
     application.add_handler(CommandHandler('luna', moon))
+    application.add_handler(CommandHandler('ubicacion', ubicacion))
+    # Solo el mensaje original: una ubicación en tiempo real llega después como edited_message cada pocos segundos.
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.LOCATION, shared_location))
     application.add_handler(CommandHandler('mantra', get_mantra))
     application.add_handler(CommandHandler('meditacion', get_meditacion))
     application.add_handler(CommandHandler('conjuro', get_conjuro))
     application.add_handler(note_conv_handler)
     application.add_handler(CommandHandler('logros', show_logros))
+    application.add_handler(CallbackQueryHandler(change_logros_page, pattern=r"^logros:"))
+    application.add_handler(CommandHandler('buscar', buscar))
+    application.add_handler(CommandHandler('patrones', patrones))
+    application.add_handler(CommandHandler('exportar', exportar))
     application.add_handler(CommandHandler('contacto', contacto))
-    logger.info("Bot iniciado correctamente. Presiona Ctrl+C para detener.")
-    await application.run_polling()
+    application.add_handler(CommandHandler('suscribir', suscribir))
+    application.add_handler(CommandHandler('desuscribir', desuscribir))
+    application.add_handler(CommandHandler('estado', estado))
+    instrument(application, METRICS)
+    register_gauges(application)
+    return application
+
+def register_gauges(application):
+    moon_cache = application.bot_data["moon_cache"]
+    METRICS.gauge("lunia_update_queue_size", "Updates en application.update_queue",
+                  lambda: application.update_queue.qsize())
+    METRICS.gauge("lunia_moon_cache_hits_total", "Aciertos de la caché de /luna",
+                  lambda: moon_cache.hits, kind="counter")
+    METRICS.gauge("lunia_moon_cache_misses_total", "Fallos de la caché de /luna",
+                  lambda: moon_cache.misses, kind="counter")
+    moon_times = application.bot_data["moon_times"]
+    METRICS.gauge("lunia_moon_times_table_hits_total", "Consultas de salida/puesta resueltas con la tabla por ciudad",
+                  lambda: moon_times.table_hits, kind="counter")
+    METRICS.gauge("lunia_moon_times_cache_hits_total", "Aciertos de la caché LRU de salida/puesta",
+                  lambda: moon_times.hits, kind="counter")
+    METRICS.gauge("lunia_moon_times_cache_misses_total", "Cálculos de salida/puesta con astral fuera de la tabla",
+                  lambda: moon_times.misses, kind="counter")
+    METRICS.gauge("lunia_content_version", "Versión del contenido cargado", lambda: CONTENT.index.version)
+
+async def start_webhook(application, port, concurrency, queue_size, webhook_url=None):
+    """Arranca la aplicación y el servidor webhook; devuelve el servidor para pararlo con stop_webhook."""
+    server = WebhookServer(application, host=os.getenv('WEBHOOK_HOST', '0.0.0.0'), port=port,
+                           secret_token=os.getenv('WEBHOOK_SECRET'),
+                           concurrency=concurrency, queue_size=queue_size)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    await server.start()
+    application.bot_data["webhook"] = server
+    METRICS.gauge("lunia_webhook_queue_size", "Updates en la cola del webhook", lambda: server.queue.qsize())
+    METRICS.gauge("lunia_webhook_rejected_total", "Updates rechazadas con 429 por cola llena",
+                  lambda: server.rejected, kind="counter")
+    if webhook_url:
+        await application.bot.set_webhook(
+            webhook_url.rstrip("/") + server.path,
+            secret_token=server.secret_token,
+            max_connections=min(100, concurrency),
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        logger.warning("WEBHOOK_URL no configurada: no se registra el webhook en Telegram")
+    return server
+
+async def stop_webhook(application, server):
+    await server.stop()
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+async def run_webhook(application, port, concurrency, queue_size):
+    import signal
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    server = await start_webhook(application, port, concurrency, queue_size, os.getenv('WEBHOOK_URL'))
+    logger.info("Bot iniciado en modo webhook. Presiona Ctrl+C para detener.")
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Deteniendo: vaciando la cola de updates...")
+        await stop_webhook(application, server)
+
+def main():
+    # argparse y signal solo hacen falta al lanzar el bot, no al importar los handlers.
+    import argparse
+    parser = argparse.ArgumentParser(description="LUN.IA bot")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=os.getenv('BOT_MODE', 'polling'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('WEBHOOK_PORT', DEFAULT_WEBHOOK_PORT)))
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('CONCURRENT_UPDATES', DEFAULT_CONCURRENCY)),
+                        help="updates procesadas en paralelo")
+    parser.add_argument('--queue-size', type=int, default=int(os.getenv('WEBHOOK_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+                        help="updates en espera antes de responder 429 (modo webhook)")
+    args = parser.parse_args()
+    # El token se comprueba al arrancar, no al importar, para poder importar
+    # los handlers por separado (benchmarks, scripts).
+    if not TOKEN:
+        logger.error("No se encontró el token de Telegram. Asegúrate de tener config.env con TELEGRAM_TOKEN")
+        sys.exit(1)
+    # TELEGRAM_API_URL permite usar un servidor Bot API local (o uno falso en los benchmarks).
+    # WORKER_INDEX lo pone runner.py en cada proceso; los trabajos diarios solo en el primero.
+    application = build_application(args.mode, args.concurrency, base_url=os.getenv('TELEGRAM_API_URL'),
+                                    jobs=os.getenv('WORKER_INDEX', '0') == '0')
+    if args.mode == "webhook":
+        asyncio.run(run_webhook(application, args.port, args.concurrency, args.queue_size))
+    else:
+        logger.info("Bot iniciado correctamente. Presiona Ctrl+C para detener.")
+        application.run_polling()
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    main()
@@ -0,0 +1,275 @@
+import json
+import time
+import logging
+import functools
+import contextvars
+from bisect import bisect_left
+
+from telegram.ext import CommandHandler, ConversationHandler
+from telegram.request import HTTPXRequest
+
+from http_server import HTTPServer, Response
+
+logger = logging.getLogger(__name__)
+timings_logger = logging.getLogger("lunia.timings")
+
+DEFAULT_PORT = 9464
+# Límites de los buckets en segundos: de 10 µs (consultas en memoria) a 10 s (Telegram lento).
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Tiempos de E/S de la update en curso, solo mientras se registran en el log JSON.
+_spans = contextvars.ContextVar("lunia_spans", default=None)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Timer:
+    """Histograma de `lunia_io_seconds` para un (tipo, operación) fijo.
+
+    Uso: `with TIMER.time(): ...`. Se crea una vez por operación para que la
+    ruta caliente sea solo perf_counter y un bisect.
+    """
+
+    __slots__ = ("name", "histogram")
+
+    def __init__(self, name, histogram):
+        self.name = name
+        self.histogram = histogram
+
+    def time(self):
+        return _Span(self)
+
+
+class _Span:
+    __slots__ = ("timer", "start")
+
+    def __init__(self, timer):
+        # Se crea en la propia sentencia `with`: arrancar aquí ahorra trabajo en __enter__.
+        self.timer = timer
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.timer.histogram.observe(elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            spans[self.timer.name] = spans.get(self.timer.name, 0.0) + elapsed
+        return False
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, extra=""):
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    """Registro de métricas en memoria con salida en formato texto de Prometheus.
+
+    Sin dependencias: los histogramas y contadores son objetos con un par de
+    enteros que se actualizan desde el event loop; los gauges son funciones
+    que se evalúan al servir /metrics. `log_timings` activa además una línea
+    de log por update con la duración y los tiempos de E/S.
+    """
+
+    def __init__(self, buckets=BUCKETS, log_timings=False):
+        self.buckets = tuple(buckets)
+        self.log_timings = log_timings
+        self._help = {}
+        self._types = {}
+        self._series = {}
+        self._gauges = {}
+
+    def _child(self, kind, name, help, labels, factory):
+        self._help.setdefault(name, help)
+        self._types.setdefault(name, kind)
+        key = (name, tuple(sorted(labels.items())))
+        child = self._series.get(key)
+        if child is None:
+            child = self._series[key] = factory()
+        return child
+
+    def histogram(self, name, help, **labels):
+        return self._child("histogram", name, help, labels, lambda: Histogram(self.buckets))
+
+    def counter(self, name, help, **labels):
+        return self._child("counter", name, help, labels, Counter)
+
+    def gauge(self, name, help, func, kind="gauge"):
+        """Valor calculado al servir /metrics; `kind="counter"` para totales que ya lleva otro objeto."""
+        self._help[name] = help
+        self._types[name] = kind
+        self._gauges[name] = func
+
+    def timer(self, kind, op):
+        histogram = self.histogram("lunia_io_seconds", "Duración de las operaciones de E/S y cálculo", kind=kind, op=op)
+        return Timer(f"{kind}.{op}", histogram)
+
+    def error(self, exc):
+        self.counter("lunia_errors_total", "Errores por tipo de excepción", type=type(exc).__name__).inc()
+
+    def wrap(self, name, callback):
+        """Envuelve un callback de handler para medir su latencia en `lunia_handler_seconds`."""
+        histogram = self.histogram("lunia_handler_seconds", "Latencia de los handlers por comando", handler=name)
+
+        @functools.wraps(callback)
+        async def timed(update, context):
+            spans = {} if self.log_timings else None
+            token = _spans.set(spans)
+            start = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                elapsed = time.perf_counter() - start
+                histogram.observe(elapsed)
+                _spans.reset(token)
+                if spans is not None:
+                    user = getattr(update, "effective_user", None)
+                    timings_logger.info(f"{name} {elapsed * 1000:.2f} ms", extra={"fields": {
+                        "handler": name,
+                        "user_id": user.id if user else None,
+                        "duration_ms": round(elapsed * 1000, 3),
+                        "io_ms": {k: round(v * 1000, 3) for k, v in spans.items()},
+                    }})
+
+        return timed
+
+    def render(self):
+        lines = []
+        by_name = {}
+        for (name, labels), child in self._series.items():
+            by_name.setdefault(name, []).append((labels, child))
+        for name in list(by_name) + list(self._gauges):
+            lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {self._types[name]}")
+            if name in self._gauges:
+                try:
+                    lines.append(f"{name} {self._gauges[name]()}")
+                except Exception as e:
+                    logger.error(f"No se pudo calcular {name}: {e}")
+                continue
+            for labels, child in by_name[name]:
+                if isinstance(child, Counter):
+                    lines.append(f"{name}{_labels(labels)} {child.value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), child.counts):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {child.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def instrument(application, metrics):
+    """Mide todos los handlers ya registrados, incluidos los de los ConversationHandler."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler, metrics)
+
+
+def _instrument_handler(handler, metrics):
+    if isinstance(handler, ConversationHandler):
+        nested = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            nested.extend(state_handlers)
+        for child in nested:
+            _instrument_handler(child, metrics)
+        return
+    if isinstance(handler, CommandHandler):
+        name = "/" + min(handler.commands)
+    else:
+        name = handler.callback.__name__
+    handler.callback = metrics.wrap(name, handler.callback)
+
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest que mide cada llamada a la Bot API como `telegram.<método>`."""
+
+    def __init__(self, metrics, **kwargs):
+        super().__init__(**kwargs)
+        self._metrics = metrics
+        self._timers = {}
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        timer = self._timers.get(endpoint)
+        if timer is None:
+            timer = self._timers[endpoint] = self._metrics.timer("telegram", endpoint)
+        with timer.time():
+            return await super().do_request(url, method, request_data, **kwargs)
+
+
+class MetricsServer:
+    """Sirve GET /metrics en un puerto local para que lo lea Prometheus."""
+
+    def __init__(self, metrics, host="127.0.0.1", port=DEFAULT_PORT):
+        self.metrics = metrics
+        self.http = HTTPServer(self.handle, host, port)
+
+    @property
+    def port(self):
+        return self.http.port
+
+    async def start(self):
+        await self.http.start()
+        logger.info(f"Métricas en http://{self.http.host}:{self.port}/metrics")
+        return self
+
+    async def stop(self):
+        await self.http.stop()
+
+    async def handle(self, request):
+        if request.path != "/metrics":
+            return Response(404)
+        if request.method != "GET":
+            return Response(405)
+        return Response(200, self.metrics.render().encode("utf-8"), {"Content-Type": CONTENT_TYPE})
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro; los campos de `extra={"fields": {...}}` se añaden tal cual."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
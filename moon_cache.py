@@ -0,0 +1,89 @@
+import time
+import asyncio
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+PRERENDER_LEAD_SECONDS = 300
+
+CacheEntry = namedtuple("CacheEntry", "key text valid_from expires_at")
+
+
+class BoundaryCache:
+    """Caché de mensajes renderizados que caducan en una frontera exacta.
+
+    `key_func(ts)` devuelve la clave del mensaje vigente en el instante `ts`
+    (timestamp Unix), `render_func(ts)` lo genera y `boundary_func(ts)`
+    devuelve el timestamp en que deja de ser válido (cambio de día, de fase...).
+    Mientras no se cruce la frontera, `get` solo compara un número y devuelve
+    el texto ya generado.
+    """
+
+    def __init__(self, key_func, render_func, boundary_func):
+        self._key_func = key_func
+        self._render_func = render_func
+        self._boundary_func = boundary_func
+        self._current = None
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.prerendered = 0
+
+    def get(self, ts=None):
+        if ts is None:
+            ts = time.time()
+        current = self._current
+        if current is not None and current.valid_from <= ts < current.expires_at:
+            self.hits += 1
+            return current.text
+        key = self._key_func(ts)
+        entry = self._entries.get(key)
+        if entry is not None and entry.valid_from <= ts < entry.expires_at:
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = self._store(key, ts)
+        self._current = entry
+        return entry.text
+
+    def prerender(self, ts):
+        """Genera por adelantado el mensaje que estará vigente en `ts`."""
+        key = self._key_func(ts)
+        entry = self._entries.get(key)
+        if entry is None or not entry.valid_from <= ts < entry.expires_at:
+            self._store(key, ts)
+            self.prerendered += 1
+
+    def clear(self):
+        """Descarta todo lo renderizado (p. ej. tras recargar el contenido)."""
+        self._current = None
+        self._entries = {}
+
+    def next_boundary(self, ts=None):
+        return self._boundary_func(time.time() if ts is None else ts)
+
+    def _store(self, key, ts):
+        entry = CacheEntry(key, self._render_func(ts), ts, self._boundary_func(ts))
+        self._entries = {k: e for k, e in self._entries.items() if e.expires_at > ts}
+        self._entries[key] = entry
+        return entry
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "prerendered": self.prerendered, "entries": len(self._entries)}
+
+
+async def prerender_loop(cache, lead=PRERENDER_LEAD_SECONDS):
+    """Renderiza cada mensaje `lead` segundos antes de su frontera."""
+    while True:
+        try:
+            boundary = cache.next_boundary()
+            await asyncio.sleep(max(0, boundary - lead - time.time()))
+            cache.prerender(boundary)
+            logger.info(f"Mensaje lunar pre-renderizado para {time.strftime('%Y-%m-%d %H:%M', time.localtime(boundary))}")
+            await asyncio.sleep(max(0, boundary - time.time()) + 1)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error pre-renderizando mensaje lunar: {e}")
+            await asyncio.sleep(60)
@@ -0,0 +1,297 @@
+"""Salida y puesta de la luna por ciudad o por coordenadas.
+
+Cada cálculo de astral (moonrise/moonset) es un método iterativo de ~1 ms.
+Para las ciudades conocidas (cities.json) se precalcula una tabla
+(ciudad, fecha) -> salida/puesta para las próximas semanas en otro proceso,
+y cada consulta es una búsqueda en un diccionario. Las coordenadas
+arbitrarias se redondean a una celda de GRID_STEP grados (~11 km, error de
+pocos segundos) y sus resultados se guardan en una caché LRU acotada.
+La tabla se guarda en disco (moon_times.snapshot): al reiniciar, o con
+varios workers, solo se calculan los días que falten.
+
+Uso: python moon_times.py            # precalcula la tabla y la guarda
+     python moon_times.py <ciudad>   # salida y puesta de hoy en esa ciudad
+"""
+import os
+import sys
+import json
+import math
+import marshal
+import time
+import asyncio
+import logging
+import unicodedata
+from collections import namedtuple, OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+CITIES_PATH = "cities.json"
+MOON_TIMES_PATH = "moon_times.snapshot"
+SNAPSHOT_FORMAT = 1
+DAYS_AHEAD = 21
+GRID_STEP = 0.1
+GRID_CACHE_SIZE = 10000
+# Más lejos de cualquier ciudad conocida, la zona horaria sale de la longitud.
+NEAREST_CITY_MAX_KM = 500
+
+City = namedtuple("City", "key name lat lon tz")
+# Timestamps Unix; None si ese día la luna no sale (o no se pone).
+RiseSet = namedtuple("RiseSet", "rise set")
+
+
+def normalize_place(name):
+    decomposed = unicodedata.normalize("NFKD", " ".join(name.split()).lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def load_cities(path=CITIES_PATH):
+    """Devuelve (ciudades por clave, clave por nombre o alias normalizado)."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    cities, names = {}, {}
+    for entry in raw:
+        key = normalize_place(entry["name"])
+        cities[key] = City(key, entry["name"], entry["lat"], entry["lon"], entry["tz"])
+        for name in [entry["name"], *entry.get("aliases", [])]:
+            names[normalize_place(name)] = key
+    return cities, names
+
+
+def rise_set(lat, lon, tz, day):
+    """Salida y puesta de la luna en el día local `day` de la zona `tz` (cálculo completo con astral)."""
+    # astral solo se importa al calcular: en el arranque no hace falta.
+    from astral import Observer
+    from astral.moon import moonrise, moonset
+    observer = Observer(lat, lon)
+    return RiseSet(_event(moonrise, observer, day, tz), _event(moonset, observer, day, tz))
+
+
+def _event(func, observer, day, tz):
+    try:
+        event = func(observer, day, tz)
+    except ValueError:
+        # astral lanza ValueError (o a veces devuelve None) los días en que la luna no sale o no se pone.
+        return None
+    return event.timestamp() if event is not None else None
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(a))
+
+
+class MoonTimes:
+    """Tabla precalculada por ciudad y caché LRU por celda de la rejilla.
+
+    La tabla nunca se modifica en sitio: `build` y `load` la sustituyen
+    entera, así que las consultas desde el event loop nunca ven una tabla a
+    medias. Lo que no está en la tabla (una ciudad antes de que termine el
+    primer cálculo, una fecha fuera de la ventana) se calcula al momento y
+    va a la LRU.
+    """
+
+    def __init__(self, cities, names=None, days=DAYS_AHEAD, cache_size=GRID_CACHE_SIZE, grid_step=GRID_STEP,
+                 path=None):
+        self.cities = cities
+        self.names = names or {key: key for key in cities}
+        self.days = days
+        self.cache_size = cache_size
+        self.grid_step = grid_step
+        self.path = path
+        self._table = {}
+        self._cache = OrderedDict()
+        self._zones = {}
+        self.table_hits = 0
+        self.hits = 0
+        self.misses = 0
+
+    def zone(self, name):
+        tz = self._zones.get(name)
+        if tz is None:
+            tz = self._zones[name] = ZoneInfo(name)
+        return tz
+
+    def find_city(self, name):
+        key = self.names.get(normalize_place(name))
+        return self.cities[key] if key is not None else None
+
+    def nearest_city(self, lat, lon):
+        """(ciudad más cercana, distancia en km)."""
+        return min(((c, distance_km(lat, lon, c.lat, c.lon)) for c in self.cities.values()), key=lambda item: item[1])
+
+    def zone_for(self, lat, lon):
+        """Zona horaria probable de unas coordenadas: la de la ciudad conocida más cercana."""
+        city, km = self.nearest_city(lat, lon)
+        if km <= NEAREST_CITY_MAX_KM:
+            return city.tz
+        # Etc/GMT tiene el signo al revés: Etc/GMT-3 es UTC+3.
+        offset = round(lon / 15)
+        return f"Etc/GMT{-offset:+d}" if offset else "UTC"
+
+    def today(self, tz_name, ts=None):
+        return datetime.fromtimestamp(time.time() if ts is None else ts, self.zone(tz_name)).date()
+
+    def for_city(self, city, day):
+        times = self._table.get((city.key, day))
+        if times is not None:
+            self.table_hits += 1
+            return times
+        return self._cached(("city", city.key, day), city.lat, city.lon, city.tz, day)
+
+    def for_coordinates(self, lat, lon, tz_name, day):
+        step = self.grid_step
+        cell_lat, cell_lon = round(lat / step) * step, round(lon / step) * step
+        return self._cached((round(lat / step), round(lon / step), tz_name, day), cell_lat, cell_lon, tz_name, day)
+
+    def _cached(self, key, lat, lon, tz_name, day):
+        cache = self._cache
+        times = cache.get(key)
+        if times is not None:
+            cache.move_to_end(key)
+            self.hits += 1
+            return times
+        self.misses += 1
+        times = cache[key] = rise_set(lat, lon, self.zone(tz_name), day)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return times
+
+    @staticmethod
+    def _window_start():
+        # Un día antes que UTC: en América ya es ayer cuando en UTC ha cambiado la fecha.
+        return datetime.now(timezone.utc).date() - timedelta(days=1)
+
+    def missing(self, start=None):
+        """Entradas de la ventana que aún no están en la tabla."""
+        start = start or self._window_start()
+        table = self._table
+        return sum((city.key, start + timedelta(days=offset)) not in table
+                   for offset in range(self.days + 1) for city in self.cities.values())
+
+    def build(self, start=None):
+        """Calcula lo que falte de la tabla para los próximos `days` días y descarta los pasados."""
+        start = start or self._window_start()
+        table = {key: times for key, times in self._table.items() if key[1] >= start}
+        computed = 0
+        for offset in range(self.days + 1):
+            day = start + timedelta(days=offset)
+            missing = [city for city in self.cities.values() if (city.key, day) not in table]
+            for city in missing:
+                table[(city.key, day)] = rise_set(city.lat, city.lon, self.zone(city.tz), day)
+            if missing:
+                computed += len(missing)
+                # Copia nueva por día: las consultas ven cada día en cuanto está listo.
+                self._table = dict(table)
+        self._table = table
+        return computed
+
+    def save(self, path):
+        """Guarda la tabla con marshal, junto con las coordenadas y zona de cada ciudad."""
+        payload = {
+            "format": SNAPSHOT_FORMAT,
+            "cities": {city.key: (city.lat, city.lon, city.tz) for city in self.cities.values()},
+            "rows": [(key, day.toordinal(), times.rise, times.set) for (key, day), times in self._table.items()],
+        }
+        # Un nombre temporal por proceso: varios workers pueden guardar a la vez.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            marshal.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Añade a la tabla lo guardado de las ciudades que no han cambiado; devuelve cuántas entradas."""
+        try:
+            with open(path, "rb") as f:
+                payload = marshal.loads(f.read())
+        except FileNotFoundError:
+            return 0
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            logger.warning(f"Tabla de salida/puesta no legible ({path}): {e}")
+            return 0
+        if not isinstance(payload, dict) or payload.get("format") != SNAPSHOT_FORMAT:
+            logger.warning(f"Tabla de salida/puesta de otra versión ({path}), se recalcula")
+            return 0
+        current = {city.key: (city.lat, city.lon, city.tz) for city in self.cities.values()}
+        valid = {key for key, saved in payload["cities"].items() if current.get(key) == saved}
+        table = dict(self._table)
+        for key, ordinal, rise, set_ in payload["rows"]:
+            if key in valid:
+                table[(key, date.fromordinal(ordinal))] = RiseSet(rise, set_)
+        loaded = len(table) - len(self._table)
+        self._table = table
+        return loaded
+
+    async def _build_in_background(self):
+        # ~5 s de CPU en Python puro: en otro proceso (con nice) no compite por el
+        # GIL con los handlers, que mientras tanto calculan al momento lo que piden.
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--background",
+            env=dict(os.environ, MOON_TIMES_PATH=self.path), stdout=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        if returncode != 0:
+            return False
+        await asyncio.to_thread(self.load, self.path)
+        return True
+
+    async def refresh_loop(self):
+        """Mantiene la tabla al día: la rellena al arrancar y añade un día tras cada medianoche UTC."""
+        while True:
+            try:
+                if self.path:
+                    await asyncio.to_thread(self.load, self.path)
+                missing = self.missing()
+                if missing:
+                    t0 = time.perf_counter()
+                    # Sin fichero (o si falla el proceso aparte) se calcula en un hilo.
+                    if not (self.path and await self._build_in_background()):
+                        await asyncio.to_thread(self.build)
+                    logger.info(f"Tabla de salida/puesta de la luna: {missing} entradas nuevas "
+                                f"en {time.perf_counter() - t0:.1f} s ({len(self._table)} en total)")
+                now = datetime.now(timezone.utc)
+                tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+                await asyncio.sleep((tomorrow - now).total_seconds() + 60)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error calculando la tabla de salida/puesta de la luna: {e}")
+                await asyncio.sleep(600)
+
+    def stats(self):
+        return {"table": len(self._table), "table_hits": self.table_hits, "hits": self.hits,
+                "misses": self.misses, "cached": len(self._cache)}
+
+
+def _format_time(ts, tz):
+    return datetime.fromtimestamp(ts, tz).strftime("%H:%M") if ts is not None else "—"
+
+
+if __name__ == "__main__":
+    if "--background" in sys.argv[1:] and hasattr(os, "nice"):
+        # Lanzado por el bot: con una sola CPU, que no le quite tiempo a los handlers.
+        os.nice(19)
+    logging.basicConfig(level=logging.INFO)
+    args = [arg for arg in sys.argv[1:] if arg != "--background"]
+    path = os.getenv('MOON_TIMES_PATH', MOON_TIMES_PATH)
+    moon_times = MoonTimes(*load_cities(), path=path)
+    moon_times.load(path)
+    if not args:
+        t0 = time.perf_counter()
+        computed = moon_times.build()
+        moon_times.save(path)
+        print(f"{path}: {computed} entradas nuevas en {time.perf_counter() - t0:.1f} s "
+              f"({len(moon_times.cities)} ciudades x {DAYS_AHEAD + 1} días)")
+        sys.exit(0)
+    city = moon_times.find_city(" ".join(args))
+    if city is None:
+        sys.exit("Ciudad desconocida")
+    tz = moon_times.zone(city.tz)
+    times = moon_times.for_city(city, moon_times.today(city.tz))
+    print(f"{city.name}: salida {_format_time(times.rise, tz)}  puesta {_format_time(times.set, tz)}  ({city.tz})")
@@ -0,0 +1,506 @@
+import io
+import os
+import re
+import csv
+import json
+import asyncio
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = "user_notes.db"
+DEFAULT_LOG_PATH = "user_notes.log"
+LEGACY_NOTES_PATH = "user_notes.json"
+PAGE_SIZE = 10
+SEARCH_LIMIT = 10
+# Notas por lectura al exportar: solo un trozo está en memoria a la vez.
+EXPORT_CHUNK = 500
+EXPORT_FORMATS = ("csv", "json")
+EXPORT_FIELDS = ("date", "phase", "note")
+
+
+class NoteStore:
+    """Almacén de notas por usuario.
+
+    Las subclases implementan los métodos síncronos (`append`, `append_many`,
+    `recent`, `page`, `search`, `stats`, `export`, `count`); los handlers
+    usan las variantes async, que ejecutan el trabajo de disco en un pool de
+    hilos propio para no bloquear el event loop.
+
+    Cada nota leída lleva un `id` que crece con el orden de inserción dentro
+    de cada usuario; es el cursor de `page`.
+    """
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="notes")
+
+    def append(self, user_id, entry):
+        raise NotImplementedError
+
+    def append_many(self, rows):
+        for user_id, entry in rows:
+            self.append(user_id, entry)
+
+    def recent(self, user_id, limit=10):
+        """Devuelve las últimas `limit` notas del usuario, de la más nueva a la más antigua."""
+        raise NotImplementedError
+
+    def page(self, user_id, before=None, after=None, limit=PAGE_SIZE):
+        """Una página de notas, de la más nueva a la más antigua, y si hay más en esa dirección.
+
+        Sin cursor es la primera página; con `before` las `limit` notas
+        anteriores a esa id y con `after` las `limit` posteriores.
+        """
+        raise NotImplementedError
+
+    def search(self, user_id, text, limit=SEARCH_LIMIT):
+        """Notas que contienen todas las palabras de `text` (o palabras que empiezan por ellas)."""
+        raise NotImplementedError
+
+    def stats(self, user_id):
+        """Número de notas por fase (`phases`) y por mes `AAAA-MM` (`months`)."""
+        raise NotImplementedError
+
+    def export(self, user_id, chunk_size=EXPORT_CHUNK):
+        """Generador con todas las notas del usuario, de la más antigua a la más nueva, en listas de `chunk_size`."""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def add_note(self, user_id, entry):
+        await self._run(self.append, str(user_id), entry)
+
+    async def recent_notes(self, user_id, limit=10):
+        return await self._run(self.recent, str(user_id), limit)
+
+    async def notes_page(self, user_id, before=None, after=None, limit=PAGE_SIZE):
+        return await self._run(self.page, str(user_id), before, after, limit)
+
+    async def search_notes(self, user_id, text, limit=SEARCH_LIMIT):
+        return await self._run(self.search, str(user_id), text, limit)
+
+    async def note_stats(self, user_id):
+        return await self._run(self.stats, str(user_id))
+
+    async def export_notes(self, user_id, fmt, out):
+        """Escribe todas las notas en el fichero binario `out`; devuelve cuántas."""
+        return await self._run(lambda: write_export(self.export(str(user_id)), fmt, out))
+
+
+def write_export(chunks, fmt, out):
+    """Vuelca en `out` (binario) las notas de `chunks` en CSV o JSON, trozo a trozo."""
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    total = 0
+    try:
+        if fmt == "csv":
+            writer = csv.writer(text)
+            writer.writerow(EXPORT_FIELDS)
+            for chunk in chunks:
+                writer.writerows([n[field] for field in EXPORT_FIELDS] for n in chunk)
+                total += len(chunk)
+        elif fmt == "json":
+            text.write("[")
+            for chunk in chunks:
+                for n in chunk:
+                    text.write(",\n" if total else "\n")
+                    json.dump({field: n[field] for field in EXPORT_FIELDS}, text, ensure_ascii=False)
+                    total += 1
+            text.write("\n]\n")
+        else:
+            raise ValueError(f"Formato de exportación desconocido: {fmt}")
+        text.flush()
+    finally:
+        # `out` sigue siendo de quien llama.
+        text.detach()
+    return total
+
+
+def _fold(text):
+    """Minúsculas y sin tildes, para buscar sin distinguirlas."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _words(text):
+    return re.findall(r"\w+", _fold(text))
+
+
+class SQLiteNoteStore(NoteStore):
+    """Notas en SQLite (modo WAL) con índice por (user_id, id).
+
+    Cada hilo del pool mantiene su propia conexión; WAL permite lecturas
+    concurrentes mientras se escribe. Unos triggers mantienen, en la misma
+    transacción que cada nota, un índice FTS5 del texto (`notes_fts`) y los
+    contadores por fase y mes (`note_stats`), así que buscar y ver patrones
+    no recorre las notas.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, max_workers=4):
+        super().__init__(max_workers)
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS notes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                phase TEXT NOT NULL,
+                note TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_notes_user ON notes (user_id, id);
+            """
+        )
+        self._create_indexes(conn)
+
+    @staticmethod
+    def _create_indexes(conn):
+        # BEGIN IMMEDIATE: si arrancan varios workers a la vez, solo uno rellena
+        # los índices de una base anterior a ellos.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = {name for name, in conn.execute("SELECT name FROM sqlite_master")}
+            if "notes_fts" not in existing:
+                # El user_id también se indexa para que la búsqueda no mire notas ajenas.
+                conn.execute(
+                    "CREATE VIRTUAL TABLE notes_fts USING fts5(user_id, note, content='notes', "
+                    "content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+                )
+                conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+            if "note_stats" not in existing:
+                conn.execute(
+                    "CREATE TABLE note_stats (user_id TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, "
+                    "total INTEGER NOT NULL, PRIMARY KEY (user_id, kind, key)) WITHOUT ROWID"
+                )
+                conn.execute("INSERT INTO note_stats SELECT user_id, 'phase', phase, COUNT(*) FROM notes GROUP BY 1, 3")
+                conn.execute(
+                    "INSERT INTO note_stats SELECT user_id, 'month', substr(date, 1, 7), COUNT(*) FROM notes GROUP BY 1, 3"
+                )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS notes_after_insert AFTER INSERT ON notes BEGIN
+                    INSERT INTO notes_fts (rowid, user_id, note) VALUES (new.id, new.user_id, new.note);
+                    INSERT INTO note_stats VALUES (new.user_id, 'phase', new.phase, 1)
+                        ON CONFLICT DO UPDATE SET total = total + 1;
+                    INSERT INTO note_stats VALUES (new.user_id, 'month', substr(new.date, 1, 7), 1)
+                        ON CONFLICT DO UPDATE SET total = total + 1;
+                END
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS notes_after_delete AFTER DELETE ON notes BEGIN
+                    INSERT INTO notes_fts (notes_fts, rowid, user_id, note) VALUES ('delete', old.id, old.user_id, old.note);
+                    UPDATE note_stats SET total = total - 1 WHERE user_id = old.user_id
+                        AND ((kind = 'phase' AND key = old.phase) OR (kind = 'month' AND key = substr(old.date, 1, 7)));
+                END
+                """
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def append(self, user_id, entry):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO notes (user_id, date, phase, note) VALUES (?, ?, ?, ?)",
+                (user_id, entry["date"], entry["phase"], entry["note"]),
+            )
+
+    def append_many(self, rows):
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO notes (user_id, date, phase, note) VALUES (?, ?, ?, ?)",
+                ((user_id, e["date"], e["phase"], e["note"]) for user_id, e in rows),
+            )
+
+    def recent(self, user_id, limit=10):
+        rows = self._conn().execute(
+            "SELECT date, phase, note FROM notes WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, limit),
+        ).fetchall()
+        return [{"date": d, "phase": p, "note": n} for d, p, n in rows]
+
+    @staticmethod
+    def _notes(rows):
+        return [{"id": i, "date": d, "phase": p, "note": n} for i, d, p, n in rows]
+
+    def page(self, user_id, before=None, after=None, limit=PAGE_SIZE):
+        # Paginación por cursor: cada página es un rango del índice (user_id, id), sin OFFSET.
+        if after is not None:
+            rows = self._conn().execute(
+                "SELECT id, date, phase, note FROM notes WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (user_id, after, limit + 1),
+            ).fetchall()
+            return self._notes(rows[:limit])[::-1], len(rows) > limit
+        if before is not None:
+            rows = self._conn().execute(
+                "SELECT id, date, phase, note FROM notes WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (user_id, before, limit + 1),
+            ).fetchall()
+        else:
+            rows = self._conn().execute(
+                "SELECT id, date, phase, note FROM notes WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, limit + 1),
+            ).fetchall()
+        return self._notes(rows[:limit]), len(rows) > limit
+
+    def search(self, user_id, text, limit=SEARCH_LIMIT):
+        words = _words(text)
+        if not words:
+            return []
+        terms = " ".join(f'"{word}"*' for word in words)
+        rows = self._conn().execute(
+            "SELECT n.id, n.date, n.phase, n.note FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid "
+            "WHERE notes_fts MATCH ? ORDER BY notes_fts.rowid DESC LIMIT ?",
+            (f'user_id:"{user_id}" AND note:({terms})', limit),
+        ).fetchall()
+        return self._notes(rows)
+
+    def stats(self, user_id):
+        result = {"phases": {}, "months": {}}
+        rows = self._conn().execute(
+            "SELECT kind, key, total FROM note_stats WHERE user_id = ? AND total > 0", (user_id,)
+        ).fetchall()
+        for kind, key, total in rows:
+            result["phases" if kind == "phase" else "months"][key] = total
+        return result
+
+    def export(self, user_id, chunk_size=EXPORT_CHUNK):
+        last = 0
+        while True:
+            rows = self._conn().execute(
+                "SELECT id, date, phase, note FROM notes WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (user_id, last, chunk_size),
+            ).fetchall()
+            if not rows:
+                return
+            yield self._notes(rows)
+            last = rows[-1][0]
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def close(self):
+        super().close()
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+class LogNoteStore(NoteStore):
+    """Notas en un log JSON Lines de solo escritura al final.
+
+    Al abrir se recorre el log una vez para construir un índice en memoria
+    user_id -> [(offset, longitud)] y los contadores por fase y mes; después
+    cada escritura solo añade una línea (y suma a los contadores) y cada
+    lectura hace `pread` de las líneas del usuario. La id de una nota es su
+    posición en la lista del usuario. No hay índice de texto: la búsqueda
+    lee las notas del usuario de la más nueva a la más antigua.
+    """
+
+    def __init__(self, path=DEFAULT_LOG_PATH, max_workers=4):
+        super().__init__(max_workers)
+        self.path = path
+        self._lock = threading.Lock()
+        self._index = {}
+        self._stats = {}
+        self._total = 0
+        self._file = open(path, "ab")
+        self._fd = os.open(path, os.O_RDONLY)
+        self._build_index()
+
+    def _build_index(self):
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if line.endswith(b"\n"):
+                    record = json.loads(line)
+                    user_id = record["user_id"]
+                    self._index.setdefault(user_id, []).append((offset, len(line)))
+                    self._count(user_id, record)
+                    self._total += 1
+                    offset += len(line)
+                else:
+                    # Línea incompleta por un corte a mitad de escritura: se descarta.
+                    logger.warning(f"Descartando registro incompleto al final de {self.path}")
+                    break
+        self._file.truncate(offset)
+        self._file.seek(0, os.SEEK_END)
+
+    def _count(self, user_id, entry):
+        stats = self._stats.get(user_id)
+        if stats is None:
+            stats = self._stats[user_id] = {"phases": Counter(), "months": Counter()}
+        stats["phases"][entry["phase"]] += 1
+        stats["months"][entry["date"][:7]] += 1
+
+    @staticmethod
+    def _encode(user_id, entry):
+        record = {"user_id": user_id, "date": entry["date"], "phase": entry["phase"], "note": entry["note"]}
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def append(self, user_id, entry):
+        self.append_many([(user_id, entry)])
+
+    def append_many(self, rows):
+        with self._lock:
+            offset = self._file.tell()
+            chunks = []
+            for user_id, entry in rows:
+                line = self._encode(user_id, entry)
+                self._index.setdefault(user_id, []).append((offset, len(line)))
+                self._count(user_id, entry)
+                chunks.append(line)
+                offset += len(line)
+            self._file.write(b"".join(chunks))
+            self._file.flush()
+            self._total += len(chunks)
+
+    def _read(self, offset, length):
+        record = json.loads(os.pread(self._fd, length, offset))
+        del record["user_id"]
+        return record
+
+    def recent(self, user_id, limit=10):
+        with self._lock:
+            positions = self._index.get(user_id, [])[-limit:]
+        return [self._read(offset, length) for offset, length in reversed(positions)]
+
+    def _slice(self, user_id, start, end):
+        """Notas del usuario en posiciones [start, end), de la más nueva a la más antigua, con su id."""
+        with self._lock:
+            positions = self._index.get(user_id, [])[start:end]
+        return [dict(self._read(*position), id=start + i) for i, position in reversed(list(enumerate(positions)))]
+
+    def page(self, user_id, before=None, after=None, limit=PAGE_SIZE):
+        with self._lock:
+            total = len(self._index.get(user_id, []))
+        if after is not None:
+            end = min(total, after + 1 + limit)
+            return self._slice(user_id, after + 1, end), end < total
+        end = total if before is None else min(before, total)
+        start = max(0, end - limit)
+        return self._slice(user_id, start, end), start > 0
+
+    def search(self, user_id, text, limit=SEARCH_LIMIT):
+        words = _words(text)
+        if not words:
+            return []
+        with self._lock:
+            positions = list(self._index.get(user_id, []))
+        found = []
+        for i in range(len(positions) - 1, -1, -1):
+            note = self._read(*positions[i])
+            note_words = _words(note["note"])
+            if all(any(w.startswith(word) for w in note_words) for word in words):
+                found.append(dict(note, id=i))
+                if len(found) == limit:
+                    break
+        return found
+
+    def stats(self, user_id):
+        with self._lock:
+            stats = self._stats.get(user_id)
+            if stats is None:
+                return {"phases": {}, "months": {}}
+            return {"phases": dict(stats["phases"]), "months": dict(stats["months"])}
+
+    def export(self, user_id, chunk_size=EXPORT_CHUNK):
+        with self._lock:
+            total = len(self._index.get(user_id, []))
+        for start in range(0, total, chunk_size):
+            yield self._slice(user_id, start, min(total, start + chunk_size))[::-1]
+
+    def count(self):
+        return self._total
+
+    def close(self):
+        super().close()
+        self._file.close()
+        os.close(self._fd)
+
+
+def open_note_store(backend=None):
+    """Crea el almacén configurado por NOTES_BACKEND (sqlite | log)."""
+    backend = backend or os.getenv('NOTES_BACKEND', 'sqlite')
+    if backend == "sqlite":
+        return SQLiteNoteStore(os.getenv('NOTES_DB_PATH', DEFAULT_DB_PATH))
+    if backend == "log":
+        return LogNoteStore(os.getenv('NOTES_LOG_PATH', DEFAULT_LOG_PATH))
+    raise ValueError(f"Backend de notas desconocido: {backend}")
+
+
+def migrate_json_notes(store, path=LEGACY_NOTES_PATH):
+    """Importa las notas del antiguo user_notes.json y lo renombra a .migrated.
+
+    Devuelve el número de notas importadas (0 si no hay nada que migrar).
+    Antes de leerlo, el fichero se reclama renombrándolo a .migrating (un
+    rename es atómico): si varios procesos arrancan a la vez, solo uno lo
+    importa y los demás no encuentran nada que migrar.
+    """
+    claimed = path + ".migrating"
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        if os.path.exists(claimed):
+            # Otro proceso lo está importando, o un arranque anterior murió a mitad
+            # y no se sabe si sus notas llegaron a guardarse.
+            logger.warning(f"{claimed}: migración en curso en otro proceso o interrumpida; "
+                           f"si no hay otro proceso, revísalo y renómbralo a {path} para reintentar")
+        return 0
+    try:
+        with open(claimed, "r", encoding="utf-8") as f:
+            notes = json.load(f)
+        rows = [(str(user_id), entry) for user_id, entries in notes.items() for entry in entries]
+        store.append_many(rows)
+    except BaseException:
+        # append_many es una sola transacción: si falla no se ha guardado nada y se puede reintentar.
+        os.replace(claimed, path)
+        raise
+    os.replace(claimed, path + ".migrated")
+    logger.info(f"Migradas {len(rows)} notas desde {path}")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    import sys
+    from dotenv import load_dotenv
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    store = open_note_store(sys.argv[1] if len(sys.argv) > 1 else None)
+    try:
+        migrate_json_notes(store)
+    finally:
+        store.close()
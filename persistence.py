@@ -0,0 +1,188 @@
+import json
+import pickle
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = "bot_state.db"
+# Segundos entre volcados: es lo máximo que se pierde si el proceso muere de golpe.
+UPDATE_INTERVAL = 5
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistencia de python-telegram-bot en SQLite (modo WAL).
+
+    Guarda el estado de los ConversationHandler persistentes y user_data /
+    chat_data (no bot_data, que contiene los almacenes y cachés del proceso).
+    La Application ya agrupa los cambios y llama a `update_*` una vez por
+    clave cada `update_interval` segundos; aquí esas llamadas solo anotan el
+    valor en memoria (la última gana) y el lote completo se escribe después
+    en una única transacción, en un hilo aparte. Un corte deja la base en el
+    último lote confirmado, nunca a medias.
+
+    Varios procesos pueden compartir el fichero. Las conversaciones van por
+    (chat, usuario) y runner.py reparte por chat, así que cada una tiene un
+    único dueño. `user_data` y `chat_data` no: una misma usuaria escribe en
+    privado (un worker) y en un grupo (quizá otro). Por eso antes de cada
+    update se relee su fila (`refresh_*`), y solo se escribe lo que este
+    proceso ha cambiado respecto a lo último que leyó o escribió; la
+    Application pide guardar los datos de todo usuario que envía una
+    update, aunque ningún handler los haya tocado.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, update_interval=UPDATE_INTERVAL):
+        super().__init__(PersistenceInput(bot_data=False, callback_data=False), update_interval)
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                state BLOB NOT NULL,
+                PRIMARY KEY (name, key)
+            );
+            CREATE TABLE IF NOT EXISTS user_data (
+                id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chat_data (
+                id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            """
+        )
+        # (tabla, clave) -> valor serializado, o None para borrar.
+        self._pending = {}
+        # (tabla, clave) -> último valor serializado leído o escrito por este proceso.
+        self._known = {}
+        self._flush_task = None
+        self.batches = 0
+        self.rows_written = 0
+
+    def _stage(self, table, key, value):
+        data = None if value is None else pickle.dumps(value)
+        if self._known.get((table, key)) == data:
+            # Sin cambios desde la última lectura: escribirlo pisaría lo que haya guardado otro proceso.
+            return
+        self._known[(table, key)] = data
+        self._pending[(table, key)] = data
+        if self._flush_task is None or self._flush_task.done():
+            # La Application lanza todos los update_* de una pasada con gather;
+            # esta tarea se ejecuta cuando ya han terminado y vuelca el lote entero.
+            self._flush_task = asyncio.create_task(self._flush_pending())
+
+    async def _flush_pending(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await loop.run_in_executor(self._executor, self._write, batch)
+            except sqlite3.Error as e:
+                logger.error(f"No se pudo guardar el estado ({len(batch)} cambios), se reintenta en el próximo volcado: {e}")
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+                return
+
+    def _write(self, batch):
+        with self._conn:
+            for (table, key), value in batch.items():
+                if table == "conversations":
+                    name, conv_key = key
+                    if value is None:
+                        self._conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, conv_key))
+                    else:
+                        self._conn.execute("INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                                           (name, conv_key, value))
+                elif value is None:
+                    self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (key,))
+                else:
+                    self._conn.execute(f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)", (key, value))
+        self.batches += 1
+        self.rows_written += len(batch)
+
+    def _load(self, table):
+        rows = self._conn.execute(f"SELECT id, data FROM {table}").fetchall()
+        for row_id, data in rows:
+            self._known[(table, row_id)] = data
+        return {row_id: pickle.loads(data) for row_id, data in rows}
+
+    def _read_row(self, table, key):
+        row = self._conn.execute(f"SELECT data FROM {table} WHERE id = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    async def _refresh(self, table, key, current):
+        if (table, key) in self._pending:
+            # Hay cambios propios sin volcar: son más nuevos que la fila.
+            return
+        # En el hilo de las escrituras: si hay un lote en curso, se lee después de él.
+        data = await asyncio.get_running_loop().run_in_executor(self._executor, self._read_row, table, key)
+        if data == self._known.get((table, key)) or (table, key) in self._pending:
+            return
+        self._known[(table, key)] = data
+        current.clear()
+        if data is not None:
+            current.update(pickle.loads(data))
+
+    async def get_user_data(self):
+        return self._load("user_data")
+
+    async def get_chat_data(self):
+        return self._load("chat_data")
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = self._conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage("conversations", (name, json.dumps(list(key))), new_state)
+
+    async def update_user_data(self, user_id, data):
+        # Un diccionario vacío no se guarda: la mayoría de usuarios no tiene datos propios.
+        self._stage("user_data", user_id, data or None)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage("chat_data", chat_id, data or None)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._stage("user_data", user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage("chat_data", chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh("user_data", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh("chat_data", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Escribe lo pendiente y cierra la base; la Application lo llama al apagarse."""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_pending()
+        self._executor.shutdown(wait=True)
+        self._conn.close()
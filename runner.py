@@ -0,0 +1,297 @@
+"""Reparte las updates entre varios procesos del bot.
+
+Uso: python runner.py --workers 4 [--mode webhook|polling] [--port 8443]
+
+Lanza N procesos `main.py --mode webhook` escuchando en 127.0.0.1 y un
+proceso frontal que recibe las updates de Telegram (webhook público o
+getUpdates) y reenvía cada una al worker que le toca por hash consistente
+del chat (o del usuario). Así una conversación siempre la atiende el mismo
+worker, y al cambiar el número de workers solo se mueve ~1/N de los chats;
+su estado está en la persistencia compartida (bot_state.db).
+"""
+import os
+import sys
+import json
+import signal
+import asyncio
+import hashlib
+import logging
+import secrets
+import argparse
+import subprocess
+from bisect import bisect
+
+import httpx
+from dotenv import load_dotenv
+
+from http_server import HTTPServer, HTTPConnectionPool, Response
+from notes_store import open_note_store, migrate_json_notes
+from webhook import DEFAULT_PORT, DEFAULT_CONCURRENCY, DEFAULT_QUEUE_SIZE, SECRET_HEADER
+
+logger = logging.getLogger(__name__)
+
+BASE_WORKER_PORT = 18443
+REPLICAS = 100
+WORKER_CONNECTIONS = 32
+STARTUP_TIMEOUT = 60
+WATCH_INTERVAL = 1
+POLL_TIMEOUT = 30
+TELEGRAM_API_URL = "https://api.telegram.org/bot"
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Anillo de hash consistente con `replicas` puntos virtuales por nodo."""
+
+    def __init__(self, nodes, replicas=REPLICAS):
+        points = sorted((_hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas))
+        self._keys = [key for key, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        i = bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._nodes[i]
+
+
+def shard_key(update):
+    """Chat (o usuario) de una update en JSON; None si no tiene ninguno (se usa el update_id)."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return None
+
+
+class Router:
+    """Frontal: recibe updates y las reenvía a su worker.
+
+    Si el worker tiene la cola llena (429) o se está deteniendo (503), se
+    devuelve la misma respuesta para que Telegram reintente más tarde.
+    """
+
+    def __init__(self, worker_ports, host="0.0.0.0", port=DEFAULT_PORT, path="/webhook",
+                 secret_token=None, worker_secret=None):
+        self.path = path
+        self.secret_token = secret_token
+        self.worker_secret = worker_secret
+        self.pools = {i: HTTPConnectionPool("127.0.0.1", p, WORKER_CONNECTIONS) for i, p in enumerate(worker_ports)}
+        self.ring = HashRing(list(self.pools))
+        self.http = HTTPServer(self.handle, host, port)
+        self.forwarded = [0] * len(worker_ports)
+
+    def worker_for(self, update):
+        key = shard_key(update)
+        return self.ring.node_for(update.get("update_id") if key is None else key)
+
+    async def forward(self, update, body=None):
+        worker = self.worker_for(update)
+        headers = {"Content-Type": "application/json"}
+        if self.worker_secret:
+            headers[SECRET_HEADER] = self.worker_secret
+        try:
+            response = await self.pools[worker].request("POST", "/webhook", body or json.dumps(update).encode(), headers)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            logger.error(f"Worker {worker} no disponible: {e}")
+            return Response(503, headers={"Retry-After": "5"})
+        if response.status == 200:
+            self.forwarded[worker] += 1
+        retry_after = response.headers.get("retry-after")
+        return Response(response.status, headers={"Retry-After": retry_after} if retry_after else None)
+
+    async def handle(self, request):
+        if request.path != self.path:
+            return Response(404)
+        if request.method != "POST":
+            return Response(405)
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            return Response(403)
+        try:
+            update = json.loads(request.body)
+        except ValueError:
+            return Response(400)
+        return await self.forward(update, request.body)
+
+    async def poll(self, api_url):
+        """Modo polling: un único getUpdates para todos los workers."""
+        offset = 0
+        async with httpx.AsyncClient(timeout=POLL_TIMEOUT + 10) as client:
+            await client.post(f"{api_url}/deleteWebhook")
+            while True:
+                try:
+                    response = await client.post(f"{api_url}/getUpdates", json={"offset": offset, "timeout": POLL_TIMEOUT})
+                    updates = response.json()["result"]
+                except (httpx.HTTPError, ValueError, KeyError) as e:
+                    logger.error(f"Error en getUpdates: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                await self.deliver_batch(updates)
+                if updates:
+                    offset = updates[-1]["update_id"] + 1
+
+    async def deliver_batch(self, updates):
+        """Reenvía un lote de getUpdates: cada chat en orden, chats distintos en paralelo."""
+        by_chat = {}
+        for update in updates:
+            key = shard_key(update)
+            by_chat.setdefault(update.get("update_id") if key is None else key, []).append(update)
+        await asyncio.gather(*(self._deliver_in_order(chat_updates) for chat_updates in by_chat.values()))
+
+    async def _deliver_in_order(self, updates):
+        # La siguiente no se envía hasta que el worker ha encolado la anterior
+        # (/anotar y el texto de la nota no pueden llegar al revés).
+        for update in updates:
+            await self._deliver(update)
+
+    async def _deliver(self, update):
+        # En polling nadie reintenta por nosotros: se insiste hasta que el worker la acepte.
+        # Si el worker ha muerto, watch_workers detiene el runner y cancela esto.
+        while True:
+            response = await self.forward(update)
+            if response.status == 200:
+                return
+            await asyncio.sleep(float((response.headers or {}).get("Retry-After", 1)))
+
+    async def close(self):
+        for pool in self.pools.values():
+            await pool.close()
+
+
+def spawn_workers(count, base_port, concurrency, queue_size, worker_secret):
+    processes = []
+    for i in range(count):
+        env = dict(os.environ, WORKER_INDEX=str(i), WEBHOOK_HOST="127.0.0.1", WEBHOOK_SECRET=worker_secret)
+        env.pop("WEBHOOK_URL", None)
+        if os.getenv("METRICS_PORT"):
+            env["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + i)
+        args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+                "--mode", "webhook", "--port", str(base_port + i),
+                "--concurrency", str(concurrency), "--queue-size", str(queue_size)]
+        # En su propia sesión: Ctrl+C llega solo al runner, que para a los workers en orden.
+        processes.append(subprocess.Popen(args, env=env, start_new_session=True))
+    return processes
+
+
+async def wait_ready(ports, processes, timeout=STARTUP_TIMEOUT):
+    deadline = asyncio.get_running_loop().time() + timeout
+    for port, process in zip(ports, processes):
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"El worker del puerto {port} terminó con código {process.returncode}")
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.close()
+                break
+            except OSError:
+                if asyncio.get_running_loop().time() > deadline:
+                    raise RuntimeError(f"El worker del puerto {port} no arrancó en {timeout} s")
+                await asyncio.sleep(0.05)
+
+
+async def watch_workers(processes, stop, interval=WATCH_INTERVAL):
+    """Detiene el runner si un worker termina: sus chats se quedarían sin atender.
+
+    Devuelve el índice del worker caído, o None si el runner se detiene por otra causa.
+    """
+    while not stop.is_set():
+        for i, process in enumerate(processes):
+            if process.poll() is not None:
+                logger.error(f"El worker {i} terminó con código {process.returncode}, se detiene el runner")
+                stop.set()
+                return i
+        await asyncio.sleep(interval)
+    return None
+
+
+async def run(args):
+    """Devuelve False si el runner se detuvo porque se cayó un worker."""
+    token = os.getenv('TELEGRAM_TOKEN')
+    if not token:
+        logger.error("No se encontró el token de Telegram. Asegúrate de tener config.env con TELEGRAM_TOKEN")
+        sys.exit(1)
+    if args.workers > 1 and os.getenv('NOTES_BACKEND', 'sqlite') != 'sqlite':
+        # El índice en memoria de LogNoteStore no ve lo que escriben otros procesos.
+        logger.error("Con varios workers las notas deben estar en SQLite (NOTES_BACKEND=sqlite)")
+        sys.exit(1)
+    # La importación del antiguo user_notes.json se hace aquí, una sola vez,
+    # antes de que los workers arranquen y la intenten cada uno por su lado.
+    notes = open_note_store()
+    try:
+        migrate_json_notes(notes)
+    finally:
+        notes.close()
+    worker_secret = secrets.token_urlsafe(16)
+    ports = [args.worker_port + i for i in range(args.workers)]
+    processes = spawn_workers(args.workers, args.worker_port, args.concurrency, args.queue_size, worker_secret)
+    router = Router(ports, port=args.port, secret_token=os.getenv('WEBHOOK_SECRET'), worker_secret=worker_secret)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    api_url = os.getenv('TELEGRAM_API_URL', TELEGRAM_API_URL) + token
+    serving = False
+    watcher = None
+    try:
+        await wait_ready(ports, processes)
+        watcher = asyncio.create_task(watch_workers(processes, stop))
+        if args.mode == "webhook":
+            await router.http.start()
+            serving = True
+            webhook_url = os.getenv('WEBHOOK_URL')
+            if webhook_url:
+                async with httpx.AsyncClient() as client:
+                    await client.post(f"{api_url}/setWebhook", json={
+                        "url": webhook_url.rstrip("/") + router.path,
+                        "secret_token": router.secret_token,
+                        "max_connections": 100,
+                    })
+            logger.info(f"Runner escuchando en el puerto {router.http.port} con {args.workers} workers")
+            await stop.wait()
+        else:
+            logger.info(f"Runner en modo polling con {args.workers} workers")
+            poller = asyncio.create_task(router.poll(api_url))
+            await stop.wait()
+            poller.cancel()
+        return watcher.result() is None if watcher.done() else True
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        logger.info("Deteniendo workers...")
+        if serving:
+            await router.http.stop()
+        # Cada worker vacía su cola y guarda la persistencia al recibir SIGTERM.
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            await asyncio.to_thread(process.wait)
+        await router.close()
+        logger.info(f"Updates reenviadas por worker: {router.forwarded}")
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="LUN.IA bot con varios procesos")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=os.getenv('BOT_MODE', 'polling'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('WEBHOOK_PORT', DEFAULT_PORT)))
+    parser.add_argument('--worker-port', type=int, default=BASE_WORKER_PORT, help="puerto del primer worker")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('CONCURRENT_UPDATES', DEFAULT_CONCURRENCY)),
+                        help="updates en paralelo por worker")
+    parser.add_argument('--queue-size', type=int, default=int(os.getenv('WEBHOOK_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)))
+    args = parser.parse_args()
+    if not asyncio.run(run(args)):
+        # Código de error para que el supervisor (systemd, Docker...) lo reinicie.
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import json
+import time
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from http_server import HTTPServer, Response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8443
+DEFAULT_CONCURRENCY = 32
+DEFAULT_QUEUE_SIZE = 1000
+DRAIN_TIMEOUT = 30
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+def chat_key(update):
+    """Chat de una update (o su usuario si no tiene chat); None si no tiene ninguno."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    return update.effective_user.id if update.effective_user else None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Hasta `max_concurrent_updates` updates a la vez, pero las de un mismo chat de una en una.
+
+    Un ConversationHandler guarda el nuevo estado cuando termina el handler:
+    si el texto de la nota se procesara mientras /anotar aún no ha acabado,
+    se compararía con el estado anterior y se perdería. Las updates de un
+    chat esperan en un asyncio.Lock (FIFO), así que además conservan el
+    orden de llegada. Mientras esperan ocupan un hueco del límite global.
+    """
+
+    __slots__ = ("_locks",)
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # chat -> [Lock, updates de ese chat en curso o esperando]
+        self._locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = chat_key(update)
+        if key is None:
+            await coroutine
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class WebhookServer:
+    """Recibe updates de Telegram por HTTP y los procesa con un pool de workers.
+
+    Las updates entran en una cola acotada; si está llena se responde 429 y
+    Telegram reintenta la entrega más tarde, en lugar de acumular trabajo sin
+    límite en memoria. `concurrency` workers procesan las updates a través
+    del update processor de la Application, así que un handler lento no
+    bloquea a los demás y las de un mismo chat siguen en orden.
+    """
+
+    def __init__(self, application, host="0.0.0.0", port=DEFAULT_PORT, path="/webhook", secret_token=None,
+                 concurrency=DEFAULT_CONCURRENCY, queue_size=DEFAULT_QUEUE_SIZE):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.http = HTTPServer(self.handle, host, port)
+        self.accepted = 0
+        self.rejected = 0
+        self._workers = []
+        self._draining = False
+
+    @property
+    def port(self):
+        return self.http.port
+
+    async def start(self):
+        await self.http.start()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        logger.info(f"Webhook escuchando en el puerto {self.port} ({self.concurrency} workers, cola {self.queue.maxsize})")
+        return self
+
+    async def handle(self, request):
+        if request.path != self.path:
+            return Response(404)
+        if request.method != "POST":
+            return Response(405)
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            return Response(403)
+        if self._draining:
+            return Response(503, headers={"Retry-After": "5"})
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return Response(400)
+        try:
+            self.queue.put_nowait((data, time.monotonic()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return Response(429, headers={"Retry-After": "1"})
+        self.accepted += 1
+        return Response(200)
+
+    async def _worker(self):
+        while True:
+            data, _received = await self.queue.get()
+            try:
+                update = Update.de_json(data, self.application.bot)
+                # Por el update processor, como en polling: mismo límite y una sola update por chat a la vez.
+                # Hasta el lock del chat solo se espera en el semáforo, que es FIFO: se respeta el orden de la cola.
+                await self.application.update_processor.process_update(update, self.application.process_update(update))
+            except Exception as e:
+                logger.error(f"Error procesando update: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def stop(self, timeout=DRAIN_TIMEOUT):
+        """Deja de aceptar updates, espera a que se vacíe la cola y para los workers."""
+        self._draining = True
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Se descartan {self.queue.qsize()} updates pendientes tras {timeout} s")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        await self.http.stop()